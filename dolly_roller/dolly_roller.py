@@ -6,6 +6,7 @@ off of the road trailer.
 import os
 import math
 import cadquery as cq
+from cqmodel.util import init_params
 
 def mm(mm: float) -> float:
     return mm
@@ -14,7 +15,7 @@ def inches(mm: float) -> float:
     return mm * 25.4
 
 PARAMS = {
-    'axle radius': os.environ.get('AXLE_DIAMETER_MM', mm(25.7)) / 2,  # nominal 25.4 but measures big
+    'axle radius': float(os.environ.get('AXLE_DIAMETER_MM', mm(25.7))) / 2,  # nominal 25.4 but measures big
     'bearing radial clearance': mm(0.2),
     'fixed radial clearance': mm(1),  # 0 was too little in PLA, 0.5 too little for bearing slop
     'cap radial clearance': mm(2),
@@ -37,8 +38,8 @@ PARAMS = {
     'cage axial clearance': mm(1),
     'cage bearing clearance': mm(0.65),  # 0.4 was tight against 1/4" acetal rod in PETG
     'bearing center spacing': inches(0.35),
-    'length overall': os.environ.get('LENGTH_OVERALL_MM', inches(12)),
-    'central support gap': os.environ.get('CENTRAL_SUPPORT_GAP_MM', 0),
+    'length overall': float(os.environ.get('LENGTH_OVERALL_MM', inches(12))),
+    'central support gap': float(os.environ.get('CENTRAL_SUPPORT_GAP_MM', 0)),
     'hub sleeve distal radius': mm(25.3),
     'hub sleeve medial radius': mm(23.3),
     'hub sleeve distal axial': mm(11.0),  # including a chamfer
@@ -66,9 +67,9 @@ def axle_support():
     return solid - negative
 
 class Roller:
-    def __init__(self):
-        for param in PARAMS.keys():
-            setattr(self, param.replace(' ', '_'), PARAMS[param])
+    def __init__(self, params={}):
+        self.params = PARAMS
+        init_params(self, updates=params)
         self._roller_cylinder_inner_radius = self.axle_radius + self.roller_bearing_diameter + self.bearing_radial_clearance
         self._roller_cylinder_outer_radius = self._roller_cylinder_inner_radius + self.wall_thickness
         self._axle_mating_cylinder_inner_radius = self.axle_radius + self.fixed_radial_clearance
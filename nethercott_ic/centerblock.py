@@ -83,6 +83,7 @@ class CenterBlock:
         self.nut_flat_width_clearance = mm(0.2)
 
 
+    @cqmodel.util.memoize
     def _bearing_params(self):
         """Common calculations for roller and race, locating the balls.
 
@@ -1,47 +1,106 @@
 """CadQuery model renderer"""
 
 import argparse
+import asyncio
 import importlib
 import sys
-from os.path import basename, dirname, join, expanduser
-from . import view
-from . import prepare
+from os.path import basename, dirname
+from . import config
+
+# Subcommands, by module: each has main(argv) -> exit status
+COMMANDS = {
+    'build': 'batch',
+    'bench': 'bench',
+    'sweep': 'sweep',
+    'check': 'validate',
+    'plate': 'prepare',
+}
 
 def main():
-    p = argparse.ArgumentParser()
+    if sys.argv[1:2] and sys.argv[1] in COMMANDS:
+        command = importlib.import_module(f'.{COMMANDS[sys.argv[1]]}', __package__)
+        sys.exit(command.main(sys.argv[2:]))
+
+    p = argparse.ArgumentParser(epilog=f"Or: cqmodel {{{','.join(COMMANDS)}}} --help")
     p.add_argument('model', help="Python CadQuery model file.py")
     p.add_argument('--config', '--configuration', '--configure',
                    '-c', type=str, default=None)
+    p.add_argument('--workers', '-j', type=int, default=None,
+                   help="Compute parts concurrently in this many processes")
+    p.add_argument('--no-cache', action='store_true',
+                   help="Always recompute parts, skipping the geometry cache")
+    p.add_argument('--single-window', action='store_true',
+                   help="Show all of the model's parts in one viewer window")
+    p.add_argument('--layout', choices=['grid', 'assembled'], default=None,
+                   help="Single window: parts side by side, or as modeled")
+    p.add_argument('--transport', choices=['file', 'shm'], default=None,
+                   help="Hand meshes to viewers via .stl files or shared memory")
+    p.add_argument('--no-stl', action='store_true',
+                   help="With shared memory transport, skip writing .stl files")
+    p.add_argument('--lod-triangles', type=int, default=None,
+                   help="Viewers draw decimated stand-ins for parts of more triangles "
+                        "while the view moves (default 50000; 0: never)")
+    p.add_argument('--mesh-format', choices=['stl', 'npz'], default=None,
+                   help="Files viewers read: binary .stl (default) or compact indexed .npz")
+    p.add_argument('--export', action='store_true',
+                   help="Write finely tessellated .stl files once (profile print) and exit")
+    p.add_argument('--async', dest='use_async', action='store_true',
+                   help="Run the asyncio engine: a new save cancels a rebuild in progress")
+    p.add_argument('--plate-on-save', action='store_true',
+                   help="After each rebuild, pack the parts onto <model>-plate.stl "
+                        "(config 'quantities', 'plate')")
+    p.add_argument('--param-fan-out', action='store_true',
+                   help="After each rebuild, list which parts read each parameter")
+    config.add_build_options(p)
     a = p.parse_args()
 
-    if a.config:
-        fn = a.config
-        with open(fn, 'r') as f:
-            conf = json.load(f)
-    else:
-        conf = {
-            'out_dir': dirname(a.model),
-            'out_basename': basename(a.model)
-        }
-        try:
-            fn = join(dirname(a.model), "cqmodel.conf")
-            with open(fn, 'r') as f:
-                conf.update(json.load(f))
-        except OSError:
-            try:
-                fn = expanduser("~/.cqmodel.conf")
-                with open(fn, 'r') as f:
-                    conf.update(json.load(f))
-            except OSError:
-                pass
-    # except error with json: complain
+    conf = config.load(a.model, a.config)
+    if a.workers is not None:
+        conf['workers'] = a.workers
+    if a.no_cache:
+        conf['cache'] = False
+    if a.single_window:
+        conf['single_window'] = True
+    if a.layout:
+        conf['layout'] = a.layout
+    if a.transport:
+        conf['transport'] = a.transport
+    if a.no_stl:
+        conf['write_stl'] = False
+    if a.mesh_format:
+        conf['mesh_format'] = a.mesh_format
+    if a.lod_triangles is not None:
+        conf['lod_triangles'] = a.lod_triangles
+    if a.profile:
+        conf['export_profile' if a.export else 'profile'] = a.profile
+    if a.trace:
+        conf['trace'] = a.trace
+    if a.plate_on_save:
+        conf['plate_on_save'] = True
+    if a.profile_ops:
+        conf['profile_ops'] = True
+    if a.param_fan_out:
+        conf['param_fan_out'] = True
+    for limit in ('sandbox', 'part_timeout', 'part_memory_mb'):
+        if getattr(a, limit):
+            conf[limit] = getattr(a, limit)
+
+    # Imported here, not at top, so that processes spawned to run viewers
+    # (which re-import the main module) don't pay for loading cadquery.
+    from . import view
 
     model_modulename = basename(a.model).split('.py', 1)[0]
 
     sys.path.insert(0, dirname(a.model))
     model = importlib.import_module(model_modulename)  # proves it can be done
 
-    view.ModelVisualizer(a.model, model_modulename, conf).run_sync()
+    visualizer = view.ModelVisualizer(a.model, model_modulename, conf)
+    if a.export:
+        visualizer.export()
+    elif a.use_async:
+        asyncio.run(visualizer.run_async())
+    else:
+        visualizer.run_sync()
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,157 @@
+"""Build every model in a tree of model directories, without viewers.
+
+    cqmodel build [path ...]
+
+A path is a model .py file, a model directory, or a directory of model
+directories (like this repository).  A model is a .py file defining
+instance() or instances() at top level.  Parts build in parallel across
+processes and get written next to their model, like the viewer does, and a
+per-part summary follows.  Exit status is 1 if any part failed.
+
+Parts whose inputs haven't changed since they were last built, and whose
+outputs are still there, are skipped (see cqmodel.deps); --force rebuilds.
+"""
+
+import argparse
+import ast
+import os
+import time
+import multiprocessing as mp
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from os.path import dirname, isdir, isfile, join, relpath
+from . import config
+from . import validate
+
+SKIP_DIRS = {'src', 'build', 'dist', '__pycache__'}
+
+def is_model(pyfile:str) -> bool:
+    """Does pyfile define instance() or instances()?  Parsed, not imported."""
+    try:
+        with open(pyfile, 'r') as f:
+            tree = ast.parse(f.read())
+    except (OSError, SyntaxError, UnicodeDecodeError):
+        return False
+    return any(isinstance(node, ast.FunctionDef) and node.name in ('instance', 'instances')
+               for node in tree.body)
+
+def discover(paths) -> list:
+    """Model .py files at, in, or one directory below each of paths"""
+    found = []
+
+    def scan(d):
+        for name in sorted(os.listdir(d)):
+            if name.endswith('.py') and is_model(join(d, name)):
+                found.append(join(d, name))
+
+    for path in paths:
+        if isfile(path):
+            found.append(path)
+            continue
+        scan(path)
+        for name in sorted(os.listdir(path)):
+            sub = join(path, name)
+            if isdir(sub) and not name.startswith('.') and name not in SKIP_DIRS:
+                scan(sub)
+    return found
+
+def main(argv) -> int:
+    p = argparse.ArgumentParser(prog='cqmodel build', description=__doc__.split('\n')[0])
+    p.add_argument('paths', nargs='*', default=['.'],
+                   help="Model files, model directories, or directories of them")
+    p.add_argument('--config', '-c', type=str, default=None)
+    p.add_argument('--workers', '-j', type=int, default=os.cpu_count())
+    p.add_argument('--format', '-f', dest='formats', action='append', default=None,
+                   help="Output type by extension, repeatable (default: stl and step); "
+                        "npz is a compact indexed mesh")
+    p.add_argument('--compress', action='store_true',
+                   help="Zip-compress .npz meshes, for archiving")
+    p.add_argument('--no-cache', action='store_true')
+    p.add_argument('--force', action='store_true',
+                   help="Rebuild parts even if they're up to date")
+    config.add_build_options(p, 'print')
+    a = p.parse_args(argv)
+
+    # cadquery only loads now, after --help has had its chance
+    from . import build
+    from . import cache
+    from . import deps
+    from . import timing
+
+    conf = config.load(config_file=a.config)
+    if a.no_cache:
+        conf['cache'] = False
+    options = {'transport': 'file', 'formats': a.formats or ['stl', 'step'],
+               'incremental': True, 'profile_ops': a.profile_ops, 'compress': a.compress}
+    if a.sandbox or a.part_timeout or a.part_memory_mb:
+        options['sandbox'] = {'timeout': a.part_timeout, 'memory_mb': a.part_memory_mb}
+    options.update(build.tessellation(conf, a.profile))
+    cache_config = cache.from_config(conf)
+
+    models = []
+    results = []  # (model, instance, seconds or None, status)
+    for model in discover(a.paths):
+        problems = validate.check(model)
+        if problems:
+            print('\n'.join(problems))
+            results.append((os.path.abspath(model), '-', None, 'FAILED check'))
+        else:
+            models.append(os.path.abspath(model))
+    manifests = {dirname(m): deps.load_manifest(dirname(m)) for m in models}
+    print(f'Building {len(models)} models in {a.workers} processes')
+    started = time.perf_counter()
+    spans = []
+    with ProcessPoolExecutor(max_workers=a.workers,
+                             mp_context=mp.get_context('spawn')) as pool:
+        listings = {pool.submit(build.list_parts, m): m for m in models}
+        parts = {}
+        for future in as_completed(listings):
+            model = listings[future]
+            try:
+                specs = future.result()
+            except Exception as e:
+                results.append((model, '-', None, f'FAILED to load: {e!r}'))
+                continue
+            for instance, stl_filename in specs:
+                previous = None
+                if not a.force:
+                    previous = manifests[dirname(model)].get(deps.part_id(model, instance))
+                parts[pool.submit(build.build_part, model, instance, stl_filename, 0,
+                                  cache_config, options, previous)] = (model, instance)
+        for future in as_completed(parts):
+            model, instance = parts[future]
+            try:
+                result = future.result()
+            except Exception as e:
+                results.append((model, instance, None, f'FAILED: {e!r}'))
+                continue
+            spans += result['spans']
+            manifest = manifests[dirname(model)]
+            if result['stl'] is None:
+                status = 'FAILED (traceback above)'
+                manifest.pop(deps.part_id(model, instance), None)
+            else:
+                if result['up_to_date']:
+                    status = 'up to date'
+                else:
+                    status = 'cached' if result['cached'] else 'built'
+                if 'inputs' in result:
+                    manifest[deps.part_id(model, instance)] = {
+                        'inputs': result['inputs'], 'outputs': result['outputs']}
+            results.append((model, instance, result['seconds'], status))
+    for model_dir, manifest in manifests.items():
+        deps.save_manifest(model_dir, manifest)
+    if a.trace:
+        timing.write_trace(a.trace, spans)
+
+    failures = [r for r in results if r[3].startswith('FAILED')]
+    width = max([len(relpath(r[0])) + len(r[1]) + 1 for r in results] + [10])
+    print()
+    for model, instance, seconds, status in sorted(results, key=lambda r: -(r[2] or 0)):
+        name = f'{relpath(model)}:{instance}'
+        took = f'{seconds:8.2f} s' if seconds is not None else ' ' * 10
+        print(f'{name:{width}}  {took}  {status}')
+    if a.profile_ops:
+        print('\n' + timing.ops_report(spans))
+    print(f'\n{len(results) - len(failures)} parts ok, {len(failures)} failed, '
+          f'{time.perf_counter() - started:.1f} s overall')
+    return 1 if failures else 0
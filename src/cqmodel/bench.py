@@ -0,0 +1,156 @@
+"""Benchmark every part of the models in a tree, to catch slowdowns.
+
+    cqmodel bench [path ...] [-n REPEATS] [-o results.json] [--baseline old.json]
+
+Paths are as for cqmodel build.  Each part is built REPEATS times, each time
+in a fresh process, from scratch (no geometry cache), into a temporary
+directory.  Recorded per run, in seconds: startup (importing cadquery), load
+(importing the model), compute, tessellate, export, and view_load (reading
+the .stl, or with --mesh-format npz the .npz, as the viewer does); that
+file's size in KB; and peak RSS in MB.  Results go to JSON; given a baseline
+from an earlier run, parts whose median got slower by more than --threshold
+(a fraction) and --floor seconds (or 10 MB, or 10 KB) are reported, and the
+exit status is 1.
+"""
+
+import argparse
+import json
+import os
+import platform
+import resource
+import statistics
+import tempfile
+import time
+import multiprocessing as mp
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from os.path import basename, join, relpath
+from . import batch
+from . import config
+
+METRICS = ('startup', 'load', 'compute', 'tessellate', 'export', 'view_load', 'size_kb',
+           'rss_mb')
+
+def run_part(model_pyfile:str, instance:str, stl_filename:str, options:dict) -> dict:
+    """Pool worker entry: one isolated build of one part, and its measurements"""
+    started = time.perf_counter()
+    from . import build
+    from .viewer import Viewer
+    run = dict.fromkeys(METRICS, 0.0)
+    run['startup'] = time.perf_counter() - started
+    with tempfile.TemporaryDirectory() as scratch:
+        stl_filename = join(scratch, basename(stl_filename).rsplit('.', 1)[0] + '.'
+                            + options['formats'][0])
+        result = build.build_part(model_pyfile, instance, stl_filename, options=options)
+        if result['stl'] is None:
+            raise RuntimeError(f'{instance} failed to build')
+        for span in result['spans']:
+            run[span['phase']] += span['seconds']
+        started = time.perf_counter()
+        Viewer.read_stl(stl_filename)
+        run['view_load'] = time.perf_counter() - started
+        run['size_kb'] = os.path.getsize(stl_filename) / 1024
+    run['rss_mb'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    return run
+
+def _isolated(context, *args) -> dict:
+    """run_part in a fresh process of its own, so no run warms another"""
+    with ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+        return pool.submit(run_part, *args).result()
+
+def median(runs:list) -> dict:
+    return {m: statistics.median(r[m] for r in runs) for m in METRICS}
+
+def compare(results:dict, baseline:dict, threshold:float, floor:float,
+            rss_floor:float=10.0, size_floor:float=10.0) -> list:
+    """[(part, metric, baseline median, new median), ...] that got worse,
+    by more than threshold (a fraction) and floor seconds, or rss_floor MB,
+    or size_floor KB"""
+    worse = []
+    for part, entry in results['parts'].items():
+        old = baseline['parts'].get(part)
+        if old is None:
+            continue
+        for metric in METRICS:
+            if metric not in old['median']:  # from before it was measured
+                continue
+            before, after = old['median'][metric], entry['median'][metric]
+            noise = {'rss_mb': rss_floor, 'size_kb': size_floor}.get(metric, floor)
+            if after > before * (1 + threshold) and after - before > noise:
+                worse.append((part, metric, before, after))
+    return worse
+
+def main(argv) -> int:
+    p = argparse.ArgumentParser(prog='cqmodel bench', description=__doc__.split('\n')[0])
+    p.add_argument('paths', nargs='*', default=['.'],
+                   help="Model files, model directories, or directories of them")
+    p.add_argument('--config', '-c', type=str, default=None)
+    p.add_argument('--repeats', '-n', type=int, default=3)
+    p.add_argument('--workers', '-j', type=int, default=1,
+                   help="Runs at once; more is quicker but noisier")
+    p.add_argument('--tessellation', dest='profile', default='print')
+    p.add_argument('--mesh-format', choices=['stl', 'npz'], default='stl',
+                   help="File the viewer reads, binary .stl or compact .npz (default stl)")
+    p.add_argument('--output', '-o', type=str, default='bench.json')
+    p.add_argument('--baseline', '-b', type=str, default=None)
+    p.add_argument('--threshold', type=float, default=0.2,
+                   help="Slowdown, as a fraction of baseline, that counts (default 0.2)")
+    p.add_argument('--floor', type=float, default=0.05,
+                   help="Seconds of slowdown too small to count (default 0.05)")
+    a = p.parse_args(argv)
+
+    from . import build
+    from . import cache
+
+    conf = config.load(config_file=a.config)
+    options = {'transport': 'file', 'formats': [a.mesh_format]}
+    options.update(build.tessellation(conf, a.profile))
+
+    models = [os.path.abspath(m) for m in batch.discover(a.paths)]
+    parts = []
+    for model in models:
+        try:
+            parts += [(model, instance, stl) for instance, stl in build.list_parts(model)]
+        except Exception as e:
+            print(f'{relpath(model)}: FAILED to load: {e!r}')
+    print(f'Benchmarking {len(parts)} parts x {a.repeats} in {a.workers} processes')
+
+    runs = {}
+    spawn = mp.get_context('spawn')
+    with ThreadPoolExecutor(max_workers=a.workers) as runner:
+        futures = {runner.submit(_isolated, spawn, model, instance, stl, options):
+                   f'{relpath(model)}:{instance}'
+                   for model, instance, stl in parts for _ in range(a.repeats)}
+        for future in as_completed(futures):
+            try:
+                runs.setdefault(futures[future], []).append(future.result())
+            except Exception as e:
+                print(f'{futures[future]}: FAILED: {e!r}')
+
+    results = {
+        'versions': f'{cache.versions()} Python {platform.python_version()}',
+        'when': time.strftime('%Y-%m-%d %H:%M:%S'),
+        'repeats': a.repeats,
+        'options': options,
+        'parts': {part: {'median': median(part_runs), 'runs': part_runs}
+                  for part, part_runs in sorted(runs.items())},
+    }
+    with open(a.output, 'w') as f:
+        json.dump(results, f, indent=1)
+
+    width = max([len(part) for part in results['parts']] + [4])
+    print(f'\n{"part":{width}}' + ''.join(f'{m:>11}' for m in METRICS))
+    for part, entry in results['parts'].items():
+        print(f'{part:{width}}' + ''.join(f'{entry["median"][m]:11.3f}' for m in METRICS))
+    print(f'\nMedians of {a.repeats}; results in {a.output}')
+
+    if a.baseline:
+        with open(a.baseline, 'r') as f:
+            baseline = json.load(f)
+        if baseline.get('versions') != results['versions']:
+            print(f'Baseline was {baseline.get("versions")}')
+        worse = compare(results, baseline, a.threshold, a.floor)
+        for part, metric, before, after in worse:
+            print(f'SLOWER {part} {metric}: {before:.3f} -> {after:.3f}')
+        print(f'{len(worse)} regressions against {a.baseline}')
+        return 1 if worse else 0
+    return 0
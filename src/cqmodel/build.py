@@ -0,0 +1,282 @@
+"""Compute the parts of a CadQuery model, in-process or from pool workers.
+
+A model module offers either instance(), a single part, or instances(), a list
+of "Class.method" and "function" names.  Each part gets written to an .stl
+named by convention next to the model file.
+"""
+
+import importlib
+import traceback
+import time
+import sys
+import os
+from os.path import dirname, basename, join
+import cadquery as cq
+from . import cache
+from . import deps
+from . import mesh
+from . import params
+from . import sandbox
+from . import timing
+from . import util
+from . import watch
+
+# Mesh fineness for exported/previewed parts: linear deflection (mm) and
+# angular deflection (radians).  Config 'tessellation' adds or overrides.
+PROFILES = {
+    'preview': {'tolerance': 0.25, 'angular_tolerance': 0.5},
+    'print': {'tolerance': 0.01, 'angular_tolerance': 0.1},
+}
+
+def tessellation(config:dict, profile:str) -> dict:
+    """The named tessellation profile, as export_part options"""
+    profiles = dict(PROFILES)
+    profiles.update(config.get('tessellation', {}))
+    if profile not in profiles:
+        raise ValueError(f'Unknown tessellation profile "{profile}", '
+                         f'not one of {", ".join(sorted(profiles))}')
+    return dict(profiles[profile])
+
+def reload_model(module):
+    """Re-import the model, after its local imports so it sees their changes"""
+    for m in watch.local_imports(module):
+        importlib.reload(m)
+    return importlib.reload(module)
+
+def part_specs(module, model_pyfile:str) -> list:
+    """Return [(instance, stl_filename), ...] for the parts of a model module"""
+    if getattr(module, 'instance', None):
+        return [('instance', model_pyfile.replace(".py", ".stl"))]
+    specs = []
+    for instance in module.instances():
+        name = instance.split('.', 1)[-1]  # "class.method" or "function"
+        specs.append((instance, join(dirname(model_pyfile), f'{name}.stl')))
+    return specs
+
+def part_name(stl_filename:str) -> str:
+    return basename(stl_filename).split('.', 1)[0]
+
+def resolve(module, instance:str, class_instances:dict):
+    """Return the callable that computes instance, sharing class instances"""
+    if '.' in instance:  # "class.method"
+        cls_name, method_name = instance.split('.', 1)
+        if cls_name not in class_instances:
+            with util.tracking_params():
+                class_instances[cls_name] = getattr(module, cls_name)()
+        return getattr(class_instances[cls_name], method_name)
+    return getattr(module, instance)  # "function"
+
+def to_shape(model):
+    """The cq.Shape for a part's result, compounding a Workplane's objects"""
+    if isinstance(model, cq.Shape):
+        return model
+    return cq.Compound.makeCompound([o for o in model.vals() if isinstance(o, cq.Shape)])
+
+def calc_part(module, instance:str, class_instances:dict, stl_filename:str,
+              geometry_cache=None):
+    """Compute one part, or load it from geometry_cache.
+
+    Returns (model, cached), model being None after reporting any trouble.
+    The compute span's details get 'params', the parameters the part read,
+    if it's a method of a class using util.init_params and was computed; and
+    with util.profile_ops on, the part's Workplane operations, as 'ops'.
+    """
+    util.take_op_profile()  # not this part's
+    with timing.span('compute', part_name(stl_filename)) as details:
+        model, details['cached'] = _calc_part(module, instance, class_instances,
+                                              stl_filename, geometry_cache, details)
+        ops = util.take_op_profile()
+        if ops:
+            details['ops'] = ops
+    return model, details['cached']
+
+def _calc_part(module, instance, class_instances, stl_filename, geometry_cache, details):
+    try:
+        part_callable = resolve(module, instance, class_instances)
+        if geometry_cache is not None:
+            key = cache.part_key(module, instance, part_callable)
+            model = geometry_cache.get(key)
+            if model is not None:
+                return model, True
+        with util.reading_params() as reads:
+            model = part_callable()
+        if util.tracks_params(getattr(part_callable, '__self__', None)):
+            details['params'] = sorted(reads)
+    except Exception as e:
+        print(f'Trouble with model "{part_name(stl_filename)}"')
+        traceback.print_exception(e)
+        return None, False
+    if geometry_cache is not None and model is not None:
+        try:
+            geometry_cache.put(key, to_shape(model))
+        except Exception as e:
+            traceback.print_exception(e)  # still have the model, so carry on
+    return model, False
+
+def export_part(model, stl_filename:str, options:dict=None):
+    """Write the part's .stl and/or publish its mesh for viewers, per options.
+
+    options 'tolerance' and 'angular_tolerance' set mesh fineness (see
+    PROFILES).  'transport' 'shm' tessellates once into shared memory, and
+    'write_stl' False then skips the .stl.  'formats' lists file types to
+    write, named by extension; default ['stl'].  .stl is binary; 'npz' is a
+    compact indexed mesh (see mesh.save), zip-compressed if 'compress'.
+    Files are written whole, then renamed into place, stamped with
+    'rebuild' if given (see mesh.stamp).  Returns the mesh descriptor when publishing, else None.
+    """
+    options = options or {}
+    tolerance = options.get('tolerance', 0.1)
+    angular_tolerance = options.get('angular_tolerance', 0.1)
+    formats = options.get('formats', ['stl'])
+    descriptor = None
+    write = options.get('write_stl', True) or options.get('transport') != 'shm'
+    with timing.span('tessellate', part_name(stl_filename)):
+        if options.get('transport') == 'shm' or (write and 'npz' in formats):
+            vertices, triangles = mesh.tessellate(to_shape(model), tolerance,
+                                                  angular_tolerance)
+        elif write and 'stl' in formats:
+            to_shape(model).mesh(tolerance, angular_tolerance)
+    if options.get('transport') == 'shm':
+        descriptor = mesh.publish(vertices, triangles)
+    if write:
+        rebuild = options.get('rebuild')
+        with timing.span('export', part_name(stl_filename)):
+            for fmt in formats:
+                out_filename = stl_filename.rsplit('.', 1)[0] + '.' + fmt
+                tmp = f'{out_filename}.{os.getpid()}.tmp'
+                if fmt == 'npz':
+                    mesh.save(tmp, vertices, triangles, options.get('compress', False),
+                              rebuild)
+                else:
+                    # Reuses the tessellation done above
+                    cq.exporters.export(model, tmp, fmt.upper(), tolerance=tolerance,
+                                        angularTolerance=angular_tolerance,
+                                        opt={'ascii': False} if fmt == 'stl' else None)
+                    if fmt == 'stl' and rebuild is not None:
+                        mesh.stamp_stl(tmp, rebuild)
+                os.replace(tmp, out_filename)  # viewers never see half a file
+    return descriptor
+
+def _compute_and_export(module, instance, class_instances, stl_filename, geometry_cache,
+                        options):
+    model, cached = calc_part(module, instance, class_instances, stl_filename, geometry_cache)
+    mesh_descriptor = None
+    if model is not None:
+        mesh_descriptor = export_part(model, stl_filename, options)
+    return {'stl': stl_filename if model is not None else None, 'cached': cached,
+            'mesh': mesh_descriptor}
+
+def _sandboxed(*args):
+    timing.take()  # the parent's, copied by the fork; the parent keeps them
+    return _compute_and_export(*args), timing.take()
+
+def build_one(module, instance:str, class_instances:dict, stl_filename:str,
+              geometry_cache=None, options:dict=None) -> dict:
+    """calc_part then export_part: {'stl' the filename, or None if the part
+    failed; 'cached'; 'mesh' descriptor or None}.
+
+    With options 'sandbox', {'timeout': seconds, 'memory_mb': MB} either
+    optional, that happens in a sandbox.run child, and a crash there is just
+    a failed part.
+    """
+    options = options or {}
+    limits = options.get('sandbox')
+    if not limits:
+        return _compute_and_export(module, instance, class_instances, stl_filename,
+                                   geometry_cache, options)
+    try:
+        resolve(module, instance, class_instances)  # so later parts share the instance
+    except Exception:
+        pass  # calc_part will say what's wrong
+    try:
+        result, spans = sandbox.run(_sandboxed, (module, instance, class_instances,
+                                                 stl_filename, geometry_cache, options),
+                                    limits.get('timeout'), limits.get('memory_mb'))
+    except sandbox.PartFailed as e:
+        print(f'Trouble with model "{part_name(stl_filename)}": {e}')
+        return {'stl': None, 'cached': False, 'mesh': None}
+    timing.add(spans)
+    return result
+
+# Pool worker state: model_pyfile -> (generation, module, class_instances)
+_loaded = {}
+# and -> (generation, overrides, class_instances) for the overrides applied
+_applied = {}
+
+def load_model(model_pyfile:str, generation:int, part:str=None):
+    """Import or re-import the model in a worker, once per generation"""
+    entry = _loaded.get(model_pyfile)
+    if entry and entry[0] == generation:
+        return entry[1], entry[2]
+    model_modulename = basename(model_pyfile).split('.py', 1)[0]
+    if dirname(model_pyfile) not in sys.path:
+        sys.path.insert(0, dirname(model_pyfile))
+    with timing.span('load', part):
+        if model_modulename in sys.modules:
+            module = reload_model(sys.modules[model_modulename])
+        else:
+            module = importlib.import_module(model_modulename)
+    _loaded[model_pyfile] = (generation, module, {})
+    return module, _loaded[model_pyfile][2]
+
+def _overridden(model_pyfile:str, module, generation:int, overrides:dict) -> dict:
+    """Class instances with overrides applied (see params.apply), once per change"""
+    entry = _applied.get(model_pyfile)
+    if not (entry and entry[0] == generation and entry[1] == overrides):
+        specs = part_specs(module, model_pyfile)
+        _applied[model_pyfile] = entry = (generation, overrides,
+                                          params.apply(module, specs, overrides))
+    return entry[2]
+
+def build_part(model_pyfile:str, instance:str, stl_filename:str, generation:int=0,
+               cache_config=None, options:dict=None, previous:dict=None,
+               overrides:dict=None):
+    """Pool worker entry: compute (or load from cache) and export one part.
+
+    cache_config is (cache_dir, max_bytes) as from cache.from_config, or None.
+    options are as for build_one, plus 'incremental': then previous is
+    the part's deps manifest entry, and nothing is done if it's up to date;
+    and 'profile_ops', for util.profile_ops.  overrides, if given, are
+    parameter overrides as for params.apply.
+    Returns a dict: 'stl' the filename, or None if the part couldn't be
+    computed; 'cached'; 'mesh' descriptor or None; 'seconds' taken; 'spans'
+    as from timing.take; and if incremental, 'inputs' digest, 'outputs', and
+    'up_to_date'.
+    """
+    started = time.perf_counter()
+    options = options or {}
+    if options.get('profile_ops'):
+        util.profile_ops()
+    module, class_instances = load_model(model_pyfile, generation, part_name(stl_filename))
+    if overrides is not None:
+        class_instances = _overridden(model_pyfile, module, generation, overrides)
+    result = {'stl': None, 'cached': False, 'mesh': None}
+    if options.get('incremental'):
+        result['outputs'] = deps.outputs(stl_filename, options)
+        result['up_to_date'] = False
+        try:
+            part_callable = resolve(module, instance, class_instances)
+            result['inputs'] = deps.digest(deps.part_inputs(module, instance,
+                                                            part_callable, options))
+        except Exception:
+            pass  # calc_part will say what's wrong
+        else:
+            if deps.up_to_date(previous, result['inputs']):
+                result.update(stl=stl_filename, up_to_date=True, spans=timing.take(),
+                              seconds=time.perf_counter() - started)
+                return result
+    geometry_cache = cache.get_cache(*cache_config) if cache_config else None
+    result.update(build_one(module, instance, class_instances, stl_filename,
+                            geometry_cache, options))
+    result['spans'] = timing.take()
+    result['seconds'] = time.perf_counter() - started
+    return result
+
+def list_parts(model_pyfile:str, generation:int=0) -> list:
+    """Pool worker entry: part_specs for a model, importing it here"""
+    module, _ = load_model(model_pyfile, generation)
+    return part_specs(module, model_pyfile)
+
+def warm(launched:float):
+    """Pool initializer: by now cadquery is loaded, so report how long that took"""
+    print(f'Worker {os.getpid()} ready in {time.time() - launched:.2f} s')
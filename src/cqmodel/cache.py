@@ -0,0 +1,240 @@
+"""On-disk cache of computed part geometry, as BREP files named by content hash.
+
+A part's key hashes the source of its callable plus whatever of its class and
+module that source refers to by name (helper methods and functions, PARAMS
+dicts and other plain data), the attributes of its class instance that it
+names (what init_params made of the params, say), its default arguments,
+the contents of the local modules the model imports (see
+watch.local_imports), and the cadquery/OCP versions.  Of dicts like PARAMS,
+only the entries the code names count.  Change one method, or override one
+parameter, and only the parts using it miss.
+
+Instances of the model's own classes that the part holds count by their
+attributes and all of their classes' code.  Anything else held, a
+cq.Workplane made in __init__ say, can't be told by content: then the whole
+model file and all of the instance's attributes go into the key.
+"""
+
+import hashlib
+import inspect
+import json
+import os
+import types
+from os.path import join, expanduser
+import cadquery as cq
+from . import params
+from . import watch
+
+PLAIN_TYPES = (int, float, complex, str, bytes, bool, type(None),
+               tuple, list, dict, types.SimpleNamespace)
+
+def versions() -> str:
+    try:
+        import OCP
+        ocp_version = getattr(OCP, '__version__', None)
+    except ImportError:
+        ocp_version = None
+    if ocp_version is None:
+        try:
+            from importlib.metadata import version
+            ocp_version = version('cadquery-ocp')
+        except Exception:
+            ocp_version = '?'
+    return f'cadquery {cq.__version__} OCP {ocp_version}'
+
+def file_digest(path:str):
+    try:
+        with open(path, 'rb') as f:
+            return hashlib.sha256(f.read()).hexdigest()
+    except OSError:
+        return None
+
+def _plain(value) -> str:
+    return json.dumps(value, sort_keys=True, default=repr)
+
+def _source(obj) -> str:
+    try:
+        return inspect.getsource(obj)
+    except (OSError, TypeError):
+        code = getattr(obj, '__code__', None)
+        return repr(code.co_code) if code else repr(obj)
+
+class _Key:
+    """What a part's code runs and reads, gathered into a hash for part_key"""
+
+    def __init__(self, module):
+        self.module = module
+        self.h = hashlib.sha256(versions().encode())
+        self.seen = set()  # functions and classes hashed
+        self.held = set()  # ids of the model's own objects gone through
+        self.used = set()  # names and strings in the code hashed
+        self.data = {}  # plain values the code refers to by name, for _used()
+        self.opaque = False  # the part holds something hashing can't see into
+
+    def own(self, obj) -> bool:
+        return getattr(obj, '__module__', None) == self.module.__name__
+
+    def callable(self, func, cls) -> None:
+        func = inspect.unwrap(getattr(func, '__func__', func))  # unbind, undecorate
+        if func in self.seen:
+            return
+        self.seen.add(func)
+        self.h.update(_source(func).encode())
+        self.h.update(_plain([func.__defaults__, func.__kwdefaults__]).encode())
+        names = params.code_names(func.__code__)
+        self.used |= names
+        for name in sorted(names):
+            if cls is not None and any(name in c.__dict__ for c in cls.__mro__[:-1]):
+                value = _function(inspect.getattr_static(cls, name))
+            elif name in vars(self.module):
+                value = vars(self.module)[name]
+            else:
+                continue
+            if isinstance(value, types.FunctionType):
+                if self.own(value):
+                    self.callable(value, cls)
+            elif isinstance(value, type):
+                if self.own(value) and value not in self.seen:
+                    self.seen.add(value)
+                    self.h.update(_source(value).encode())
+                    self.data[name] = {k: v for k, v in vars(value).items()  # e.g. class PARAMS
+                                       if not k.startswith('__') and isinstance(v, PLAIN_TYPES)}
+            elif not inspect.ismodule(value) and not callable(value):
+                self.data[name] = self.state(value)
+
+    def state(self, value):
+        """value as plain data; instances of the model's own classes by their
+        attributes, with their classes' code hashed.  Anything else, like a
+        cq.Workplane made by __init__, sets opaque."""
+        if isinstance(value, (list, tuple)):
+            return [self.state(v) for v in value]
+        if isinstance(value, dict):
+            return {k: self.state(v) for k, v in value.items()}
+        if isinstance(value, types.SimpleNamespace):
+            return self.state(vars(value))
+        if isinstance(value, PLAIN_TYPES):
+            return value
+        cls = type(value)
+        if not self.own(cls):
+            self.opaque = True
+            return cls.__qualname__
+        if id(value) in self.held:  # met before, like a model referring back to itself
+            return cls.__qualname__
+        self.held.add(id(value))
+        for c in cls.__mro__[:-1]:
+            for attr in vars(c).values():
+                if isinstance(_function(attr), types.FunctionType) and self.own(_function(attr)):
+                    self.callable(_function(attr), cls)
+        return {'class': cls.__qualname__, 'state': self.state(_attributes(value))}
+
+def _function(value):
+    """The function of a staticmethod, classmethod or property, else value"""
+    if isinstance(value, (staticmethod, classmethod)):
+        return value.__func__
+    if isinstance(value, property):
+        return value.fget
+    return value
+
+def _attributes(obj) -> dict:
+    """obj's attributes but for what cqmodel.util keeps on models"""
+    return {k: v for k, v in vars(obj).items() if k not in ('_memo', '_param_tracking')}
+
+def _used(value, used:set):
+    """Of a dict, like PARAMS, the entries the code names (with spaces or
+    underscores); all of it if it names none, being used whole, presumably"""
+    if not isinstance(value, dict):
+        return value
+    entries = {k: v for k, v in value.items() if isinstance(k, str)
+               and {k, k.replace(' ', '_'), k.replace('_', ' ')} & used}
+    return entries or value
+
+def part_key(module, instance:str, part_callable) -> str:
+    """Content hash for the geometry part_callable computes"""
+    key = _Key(module)
+    key.h.update(instance.encode())
+    owner = getattr(part_callable, '__self__', None)
+    cls = type(owner) if owner is not None else None
+    key.callable(part_callable, cls)
+    if owner is not None:
+        key.held.add(id(owner))
+        # Only attributes the code names: a parameter no method reads misses no part
+        key.data['self'] = {k: key.state(v) for k, v in _attributes(owner).items()
+                            if k in key.used}
+        init = getattr(cls, '__init__', None)
+        if isinstance(init, types.FunctionType):
+            key.h.update(_source(init).encode())
+    key.h.update(_plain({name: _used(value, key.used)
+                         for name, value in key.data.items()}).encode())
+    if key.opaque:
+        # What made it can be anywhere in the model: key on all of that
+        key.h.update(f'{module.__name__}={file_digest(getattr(module, "__file__", ""))}'.encode())
+        if owner is not None:
+            key.h.update(_plain(key.state(_attributes(owner))).encode())
+    for m in watch.local_imports(module):  # helpers there aren't followed by name
+        key.h.update(f'{m.__name__}={file_digest(m.__file__)}'.encode())
+    return key.h.hexdigest()
+
+class GeometryCache:
+    """Directory of <key>.brep, evicted least-recently-used past max_bytes"""
+
+    def __init__(self, cache_dir:str, max_bytes:int):
+        self.cache_dir = expanduser(cache_dir)
+        self.max_bytes = max_bytes
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def _path(self, key:str) -> str:
+        return join(self.cache_dir, f'{key}.brep')
+
+    def get(self, key:str):
+        """Return the cached cq.Shape for key, or None"""
+        path = self._path(key)
+        try:
+            shape = cq.Shape.importBrep(path)
+        except Exception:
+            return None
+        try:
+            os.utime(path)  # most recently used
+        except OSError:
+            pass
+        return shape
+
+    def put(self, key:str, shape) -> None:
+        path = self._path(key)
+        tmp = f'{path}.{os.getpid()}.tmp'
+        shape.exportBrep(tmp)
+        os.replace(tmp, path)  # concurrent workers never see half a file
+        self.evict()
+
+    def evict(self) -> None:
+        entries = []
+        for entry in os.scandir(self.cache_dir):
+            if entry.name.endswith('.brep'):
+                try:
+                    st = entry.stat()
+                except OSError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, entry.path))
+        total = sum(e[1] for e in entries)
+        for mtime, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.unlink(path)
+            except OSError:
+                pass  # another worker got it
+            total -= size
+
+# One cache object per directory, kept across builds in pool workers
+_caches = {}
+
+def get_cache(cache_dir:str, max_bytes:int) -> GeometryCache:
+    if cache_dir not in _caches:
+        _caches[cache_dir] = GeometryCache(cache_dir, max_bytes)
+    return _caches[cache_dir]
+
+def from_config(config:dict):
+    """Return (cache_dir, max_bytes) per config, or None if caching is off"""
+    if not config.get('cache', True):
+        return None
+    return (config.get('cache_dir', '~/.cache/cqmodel'),
+            int(config.get('cache_max_mb', 512)) * 1024 * 1024)
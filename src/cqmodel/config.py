@@ -0,0 +1,49 @@
+"""Find and read cqmodel configuration, JSON from cqmodel.conf files."""
+
+import json
+from os.path import basename, dirname, join, expanduser
+
+def load(model_pyfile:str=None, config_file:str=None) -> dict:
+    """Configuration from config_file if given, else the model's directory
+    cqmodel.conf, else ~/.cqmodel.conf, else defaults"""
+    if config_file:
+        with open(config_file, 'r') as f:
+            return json.load(f)
+    conf = {}
+    if model_pyfile:
+        conf = {
+            'out_dir': dirname(model_pyfile),
+            'out_basename': basename(model_pyfile)
+        }
+    candidates = [expanduser("~/.cqmodel.conf")]
+    if model_pyfile:
+        candidates.insert(0, join(dirname(model_pyfile), "cqmodel.conf"))
+    for fn in candidates:
+        try:
+            with open(fn, 'r') as f:
+                conf.update(json.load(f))
+            break
+        except OSError:
+            pass
+    # except error with json: complain
+    return conf
+
+def add_build_options(parser, profile:str=None) -> None:
+    """Add the options the viewer and cqmodel build share to an argparse
+    parser: --tessellation (default profile), --trace, --profile-ops,
+    --sandbox, --part-timeout and --part-memory"""
+    parser.add_argument('--tessellation', dest='profile', default=profile,
+                        help="Tessellation profile: preview, print, or one from config "
+                             f"(default {profile or 'preview'})")
+    parser.add_argument('--trace', type=str, default=None,
+                        help="Write per-part build timings to this file as a Chrome trace")
+    parser.add_argument('--profile-ops', action='store_true',
+                        help="Time each cadquery Workplane operation, reporting the "
+                             "hottest per part")
+    parser.add_argument('--sandbox', action='store_true',
+                        help="Build each part in a forked child, so a crash only fails "
+                             "that part")
+    parser.add_argument('--part-timeout', type=float, default=None,
+                        help="Sandboxed: seconds a part may take before it's killed")
+    parser.add_argument('--part-memory', dest='part_memory_mb', type=float, default=None,
+                        help="Sandboxed: MB a part may allocate before it fails")
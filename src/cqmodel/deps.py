@@ -0,0 +1,71 @@
+"""Make-style records of what each built part depended on.
+
+A part's inputs are the slice of model source it uses along with its
+parameters (cache.part_key), the local modules the model imports (e.g.
+cqmodel.util), asset files it names (e.g. .dxf), the environment variables
+the model reads (e.g. AXLE_DIAMETER_MM), and the export options.  Each model
+directory keeps a manifest of the digest of those inputs and the outputs
+written; a part whose digest matches and whose outputs exist is up to date.
+"""
+
+import ast
+import hashlib
+import json
+import os
+from os.path import isfile, join
+from . import cache
+from . import validate
+from . import watch
+
+MANIFEST = '.cqmodel-deps.json'
+
+# build.build_part options that change how a part gets built or shown, not
+# what gets written
+NOT_INPUTS = {'transport', 'incremental', 'profile_ops', 'sandbox', 'rebuild'}
+
+def env_vars(module) -> list:
+    """Names in os.environ.get('X'), os.environ['X'], os.getenv('X') in the model"""
+    try:
+        with open(module.__file__, 'r') as f:
+            tree = ast.parse(f.read())
+    except (OSError, SyntaxError):
+        return []
+    names = {validate.env_read(node) for node in ast.walk(tree)}
+    return sorted(n for n in names if isinstance(n, str))
+
+def part_inputs(module, instance:str, part_callable, options:dict) -> dict:
+    return {
+        'part': cache.part_key(module, instance, part_callable),
+        'imports': {m.__file__: cache.file_digest(m.__file__) for m in watch.local_imports(module)},
+        'assets': {p: cache.file_digest(p) for p in watch.asset_paths(module)},
+        'env': {name: os.environ.get(name) for name in env_vars(module)},
+        'options': {k: v for k, v in options.items() if k not in NOT_INPUTS},
+    }
+
+def digest(inputs:dict) -> str:
+    return hashlib.sha256(json.dumps(inputs, sort_keys=True, default=repr).encode()).hexdigest()
+
+def outputs(stl_filename:str, options:dict) -> list:
+    base = stl_filename.rsplit('.', 1)[0]
+    return [f'{base}.{fmt}' for fmt in options.get('formats', ['stl'])]
+
+def part_id(model_pyfile:str, instance:str) -> str:
+    return f'{os.path.basename(model_pyfile)}:{instance}'
+
+def load_manifest(model_dir:str) -> dict:
+    try:
+        with open(join(model_dir, MANIFEST), 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def save_manifest(model_dir:str, manifest:dict) -> None:
+    path = join(model_dir, MANIFEST)
+    with open(path + '.tmp', 'w') as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.replace(path + '.tmp', path)
+
+def up_to_date(entry, inputs_digest:str) -> bool:
+    """Was the part built from these inputs, with its outputs still there?"""
+    return (entry is not None and entry.get('inputs') == inputs_digest
+            and all(isfile(o) for o in entry.get('outputs', [])))
@@ -0,0 +1,157 @@
+"""Triangle meshes of parts, handed from builder to viewer in shared memory,
+or saved compactly to .npz files; and binary .stl read and written with numpy.
+
+A published mesh is a multiprocessing.shared_memory segment holding float32
+vertices (n, 3) followed by int64 triangle indices (m, 3) -- int64 being
+vtkIdType, so the viewer can wrap both arrays without copying.  It's
+described to other processes by a small picklable dict.
+
+Segments outlive the process that made them: the resource tracker is kept
+out of it, and whoever owns the descriptor (the watcher) calls release().
+
+A saved mesh is an .npz of float32 'vertices', each point once, and int32
+'triangles' indexing them: about a third the size of a binary .stl, which
+repeats each point for every triangle it's in, and read with no parsing.
+
+Files written during a viewing session carry a stamp naming the rebuild that
+wrote them -- in a binary .stl's 80 byte header, or an .npz's 'rebuild' --
+so viewers can tell a mesh they already show from a new one.
+"""
+
+import os
+from contextlib import contextmanager
+from multiprocessing import resource_tracker, shared_memory
+import numpy as np
+
+def tessellate(shape, tolerance:float=0.1, angular_tolerance:float=0.1):
+    """Return (vertices, triangles) numpy arrays for a cq.Shape"""
+    points, triangles = shape.tessellate(tolerance, angular_tolerance)
+    vertices = np.array([p.toTuple() for p in points], dtype=np.float32).reshape(-1, 3)
+    return vertices, np.array(triangles, dtype=np.int64).reshape(-1, 3)
+
+def compact(vertices, triangles):
+    """(vertices, triangles) with coincident vertices merged"""
+    unique, inverse = np.unique(vertices, axis=0, return_inverse=True)
+    return unique, inverse.reshape(-1)[triangles]
+
+def save(path:str, vertices, triangles, compress:bool=False, rebuild:str=None) -> None:
+    """Write a mesh to an .npz, zip-compressed if compress (smaller, slower)"""
+    vertices, triangles = compact(vertices, triangles)
+    extra = {} if rebuild is None else {'rebuild': np.array(rebuild)}
+    with open(path, 'wb') as f:
+        (np.savez_compressed if compress else np.savez)(
+            f, vertices=vertices, triangles=triangles.astype(np.int32), **extra)
+
+_STL_RECORD = np.dtype([('normal', '<f4', 3), ('points', '<f4', (3, 3)), ('attributes', '<u2')])
+
+def read(path:str):
+    """(vertices, triangles) from an .npz (see save) or a binary .stl"""
+    if path.endswith('.npz'):
+        return load(path)
+    with open(path, 'rb') as f:
+        data = f.read()
+    count = int.from_bytes(data[80:84], 'little') if len(data) >= 84 else -1
+    if len(data) != 84 + count * _STL_RECORD.itemsize:
+        raise ValueError(f'{path} is not a binary .stl')
+    vertices = np.frombuffer(data, _STL_RECORD, count, 84)['points'].reshape(-1, 3)
+    return vertices, np.arange(len(vertices), dtype=np.int64).reshape(-1, 3)
+
+def write_stl(path:str, vertices, triangles) -> None:
+    """Write a binary .stl, whole then renamed into place"""
+    corners = vertices[triangles]
+    normals = np.cross(corners[:, 1] - corners[:, 0], corners[:, 2] - corners[:, 0])
+    lengths = np.linalg.norm(normals, axis=1, keepdims=True)
+    records = np.zeros(len(triangles), _STL_RECORD)
+    records['normal'] = np.divide(normals, lengths, out=np.zeros_like(normals),
+                                  where=lengths > 0)
+    records['points'] = corners
+    tmp = f'{path}.{os.getpid()}.tmp'
+    with open(tmp, 'wb') as f:
+        f.write(b'cqmodel'.ljust(80, b' '))
+        f.write(len(records).to_bytes(4, 'little'))
+        f.write(records.tobytes())
+    os.replace(tmp, path)
+
+_STAMP = b'cqmodel rebuild '
+
+def stamp_stl(path:str, rebuild:str) -> None:
+    """Put rebuild in a binary .stl's header (which mustn't start 'solid')"""
+    with open(path, 'r+b') as f:
+        f.write((_STAMP + rebuild.encode())[:80].ljust(80, b' '))
+
+def stamp(path:str):
+    """The rebuild that wrote a mesh file, or None if unstamped or unreadable"""
+    try:
+        if path.endswith('.npz'):
+            with np.load(path) as saved:
+                return str(saved['rebuild']) if 'rebuild' in saved.files else None
+        with open(path, 'rb') as f:
+            header = f.read(80)
+    except (OSError, ValueError):
+        return None
+    if not header.startswith(_STAMP):
+        return None
+    return header[len(_STAMP):].rstrip(b' \0').decode(errors='replace')
+
+def load(path:str):
+    """(vertices, triangles) from a saved mesh, triangles as int64 (vtkIdType)"""
+    with np.load(path) as saved:
+        return saved['vertices'], saved['triangles'].astype(np.int64)
+
+@contextmanager
+def _untracked():
+    register, unregister = resource_tracker.register, resource_tracker.unregister
+
+    def skip_shm(f):
+        return lambda name, rtype: None if rtype == 'shared_memory' else f(name, rtype)
+    resource_tracker.register = skip_shm(register)
+    resource_tracker.unregister = skip_shm(unregister)
+    try:
+        yield
+    finally:
+        resource_tracker.register, resource_tracker.unregister = register, unregister
+
+def _triangles_offset(n_vertices:int) -> int:
+    return (n_vertices * 3 * 4 + 7) // 8 * 8  # int64 alignment
+
+def publish(vertices, triangles) -> dict:
+    """Copy a mesh into a new shared memory segment and describe it"""
+    offset = _triangles_offset(len(vertices))
+    size = max(1, offset + triangles.size * 8)
+    with _untracked():
+        shm = shared_memory.SharedMemory(create=True, size=size)
+    try:
+        np.ndarray(vertices.shape, np.float32, shm.buf, 0)[:] = vertices
+        np.ndarray(triangles.shape, np.int64, shm.buf, offset)[:] = triangles
+    finally:
+        shm.close()
+    return {'shm': shm.name, 'vertices': len(vertices), 'triangles': len(triangles)}
+
+def attach(descriptor:dict):
+    """Map a published mesh: (shm, vertices, triangles), arrays backed by shm.
+
+    Keep shm referenced as long as the arrays are in use.  Raises
+    FileNotFoundError if the mesh has already been released.
+    """
+    with _untracked():
+        shm = shared_memory.SharedMemory(name=descriptor['shm'])
+    n, m = descriptor['vertices'], descriptor['triangles']
+    vertices = np.ndarray((n, 3), np.float32, shm.buf, 0)
+    triangles = np.ndarray((m, 3), np.int64, shm.buf, _triangles_offset(n))
+    return shm, vertices, triangles
+
+def detach(shm) -> None:
+    try:
+        shm.close()
+    except BufferError:
+        pass  # arrays still out there; the mapping goes when they do
+
+def release(descriptor:dict) -> None:
+    """Remove a published mesh; processes that have it mapped keep it"""
+    try:
+        with _untracked():
+            shm = shared_memory.SharedMemory(name=descriptor['shm'])
+            shm.close()
+            shm.unlink()
+    except FileNotFoundError:
+        pass
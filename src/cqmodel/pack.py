@@ -0,0 +1,115 @@
+"""Pack copies of parts densely onto a build plate, for printing in quantity.
+
+A part's footprint is the convex hull of its outline seen from above, grown
+by half the gap wanted between parts.  Parts go largest first, and each copy
+at the frontmost, then leftmost, spot where it fits in any of its rotations
+about Z.  Spots are cells of a raster of the plate, and all of them are
+tried at once, by FFT correlation of the footprint with what's occupied:
+a plateful takes a fraction of a second, so it can be redone on every save.
+
+Only numpy is needed, so this works on meshes (see plate_mesh) as well as
+on cadquery shapes (see prepare).
+"""
+
+import numpy as np
+
+RESOLUTION = 1.0  # mm per raster cell
+ROTATIONS = (0, 90, 180, 270)
+
+def outline(vertices) -> np.ndarray:
+    """Convex hull of vertices seen from above, counterclockwise, as (n, 2)"""
+    points = np.unique(np.round(np.asarray(vertices)[:, :2], 2), axis=0)  # by x, then y
+    if len(points) < 3:
+        return points
+    # Only the lowest and highest of points sharing an x can be on the hull
+    starts = np.r_[0, np.flatnonzero(np.diff(points[:, 0])) + 1]
+    points = points[np.unique(np.r_[starts, np.r_[starts[1:], len(points)] - 1])]
+
+    def chain(points):
+        hull = []
+        for x, y in points:
+            while len(hull) >= 2 and ((hull[-1][0] - hull[-2][0]) * (y - hull[-2][1])
+                                      - (hull[-1][1] - hull[-2][1]) * (x - hull[-2][0])) <= 0:
+                hull.pop()
+            hull.append((x, y))
+        return hull[:-1]
+    points = points.tolist()
+    return np.array(chain(points) + chain(points[::-1]))
+
+def rotate(points, angle:float) -> np.ndarray:
+    """Points' x and y rotated angle degrees counterclockwise about Z"""
+    c, s = np.cos(np.radians(angle)), np.sin(np.radians(angle))
+    rotated = np.array(points, dtype=np.float64)
+    rotated[:, :2] = points[:, :2] @ np.array([[c, s], [-s, c]])
+    return rotated
+
+def _footprint(hull, angle:float, grow:float, resolution:float):
+    """(lower left corner, cells): raster of the hull rotated and grown"""
+    hull = rotate(hull, angle)
+    corner = hull.min(axis=0) - grow
+    nx, ny = np.ceil((hull.max(axis=0) + grow - corner) / resolution).astype(int)
+    x, y = np.meshgrid(corner[0] + (np.arange(nx) + 0.5) * resolution,
+                       corner[1] + (np.arange(ny) + 0.5) * resolution)
+    if len(hull) < 3:
+        return corner, np.ones((ny, nx), dtype=bool)
+    start = hull[:, :, None, None]
+    edge = np.roll(hull, -1, axis=0)[:, :, None, None] - start
+    inside = ((edge[:, 0] * (y - start[:, 1]) - edge[:, 1] * (x - start[:, 0]))
+              / np.hypot(edge[:, 0], edge[:, 1]))
+    # Cells the grown hull touches at all, not just those whose centers it covers
+    return corner, (inside >= -(grow + resolution * 0.71)).all(axis=0)
+
+def arrange(outlines:dict, quantities:dict=None, plate=(256, 256), gap:float=5,
+            rotations=ROTATIONS, resolution:float=RESOLUTION):
+    """Place copies of parts, {name: outline}, quantities {name: count} (default 1).
+
+    Returns ([(name, angle, (dx, dy)), ...], {name: copies that didn't fit}):
+    a placed copy is the part rotated angle degrees about Z, then moved by
+    (dx, dy).
+    """
+    quantities = quantities or {}
+    cells = np.floor(np.asarray(plate) / resolution).astype(int)
+    occupied = np.zeros((cells[1], cells[0]))
+    footprints = {(name, angle): _footprint(hull, angle, gap / 2, resolution)
+                  for name, hull in outlines.items() for angle in rotations}
+    spectra = {}
+    placed, left = [], {}
+    for name in sorted(outlines, key=lambda n: -footprints[n, rotations[0]][1].sum()):
+        for _ in range(quantities.get(name, 1)):
+            free = np.fft.rfft2(occupied)
+            best = None
+            for angle in rotations:
+                corner, footprint = footprints[name, angle]
+                ny, nx = footprint.shape
+                if ny > cells[1] or nx > cells[0]:
+                    continue
+                if (name, angle) not in spectra:
+                    spectra[name, angle] = np.conj(np.fft.rfft2(footprint, occupied.shape))
+                overlap = np.fft.irfft2(free * spectra[name, angle], occupied.shape)
+                spots = np.argwhere(overlap[:cells[1] - ny + 1, :cells[0] - nx + 1] < 0.5)
+                if len(spots) and (best is None or tuple(spots[0]) < best[0]):
+                    best = (tuple(spots[0]), angle, corner, footprint)
+            if best is None:
+                left[name] = left.get(name, 0) + 1
+                continue
+            (y, x), angle, corner, footprint = best
+            occupied[y:y + footprint.shape[0], x:x + footprint.shape[1]] += footprint
+            placed.append((name, angle, (float(x * resolution - corner[0]),
+                                          float(y * resolution - corner[1]))))
+    return placed, left
+
+def plate_mesh(meshes:dict, quantities:dict=None, **layout):
+    """Arrange meshes, {name: (vertices, triangles)}, as for arrange(); returns
+    ((vertices, triangles) of the whole plate, {name: copies that didn't fit})"""
+    placed, left = arrange({name: outline(v) for name, (v, _) in meshes.items()},
+                           quantities, **layout)
+    vertices, triangles, count = [], [], 0
+    for name, angle, (dx, dy) in placed:
+        v, t = meshes[name]
+        moved = rotate(v, angle) + (dx, dy, -v[:, 2].min())
+        vertices.append(moved.astype(np.float32))
+        triangles.append(t + count)
+        count += len(v)
+    if not placed:
+        return (np.zeros((0, 3), np.float32), np.zeros((0, 3), np.int64)), left
+    return (np.concatenate(vertices), np.concatenate(triangles)), left
@@ -0,0 +1,140 @@
+"""Parameter overrides, applied to a loaded model without reloading it.
+
+Overrides are {name: value}.  A name goes where the model keeps parameters:
+a module-level PARAMS dict (keys with spaces or underscores) or PARAMS class,
+or else the params of classes whose __init__ takes params (see
+util.init_params).  For live tuning they come from a sidecar
+<model>.params.json next to the model, watched along with it; parts that
+don't read a changed parameter aren't recomputed.  Which parameters a part
+reads is as recorded when it was last computed (see util.init_params), or
+else as found in its code by reads().
+"""
+
+import inspect
+import json
+import types
+from os.path import abspath
+
+_defaults = {}  # module name -> (its PARAMS, PARAMS' values as loaded)
+
+def sidecar(model_pyfile:str) -> str:
+    return abspath(model_pyfile).rsplit('.py', 1)[0] + '.params.json'
+
+def load(path:str):
+    """Overrides from a sidecar file: {} if there's none, None if it's broken"""
+    try:
+        with open(path, 'r') as f:
+            overrides = json.load(f)
+    except FileNotFoundError:
+        return {}
+    except (OSError, ValueError) as e:
+        print(f'Trouble reading {path}: {e}')
+        return None
+    if not isinstance(overrides, dict):
+        print(f'Trouble reading {path}: not a {{name: value}} object')
+        return None
+    return overrides
+
+def changed(old:dict, new:dict) -> set:
+    return {name for name in old.keys() | new.keys() if old.get(name) != new.get(name)}
+
+def _restore(module) -> None:
+    """Put PARAMS back as loaded, or note how it was loaded if it's new"""
+    params = getattr(module, 'PARAMS', None)
+    saved = _defaults.get(module.__name__)
+    if saved is not None and saved[0] is params:
+        if isinstance(params, dict):
+            params.clear()
+            params.update(saved[1])
+        else:
+            for name, value in saved[1].items():
+                setattr(params, name, value)
+    elif isinstance(params, dict):
+        _defaults[module.__name__] = (params, dict(params))
+    elif isinstance(params, type):
+        _defaults[module.__name__] = (params, {k: v for k, v in vars(params).items()
+                                               if not k.startswith('__')})
+
+def apply(module, specs, overrides:dict) -> dict:
+    """Put overrides in place of whatever earlier ones were applied.
+
+    Returns class instances for build.resolve, made with the overrides where
+    the class takes params.  Raises KeyError for overrides nothing takes.
+    """
+    _restore(module)
+    remaining = dict(overrides)
+    params = getattr(module, 'PARAMS', None)
+    for name, value in overrides.items():
+        if isinstance(params, dict):
+            for key in (name, name.replace('_', ' '), name.replace(' ', '_')):
+                if key in params:
+                    params[key] = value
+                    del remaining[name]
+                    break
+        elif isinstance(params, type) and hasattr(params, name.replace(' ', '_')):
+            setattr(params, name.replace(' ', '_'), value)
+            del remaining[name]
+    from . import util  # not before: loads cadquery, which validate does without
+    class_instances = {}
+    for cls_name in sorted({instance.split('.', 1)[0] for instance, _ in specs
+                            if '.' in instance}):
+        cls = getattr(module, cls_name)
+        if 'params' in inspect.signature(cls).parameters:
+            with util.tracking_params():
+                class_instances[cls_name] = cls(params=dict(remaining))  # init_params checks
+    if remaining and not class_instances:
+        raise KeyError(f'Nothing in {module.__name__} takes {", ".join(remaining)}')
+    return class_instances
+
+def code_names(code) -> set:
+    """Names and string constants of code, and of any code nested in it"""
+    names = set(code.co_names)
+    for const in code.co_consts:
+        if isinstance(const, str):
+            names.add(const)
+        elif isinstance(const, types.CodeType):
+            names |= code_names(const)
+    return names
+
+def reads(module, instance:str) -> set:
+    """Names a part's code might read parameters by, found statically.
+
+    Attribute names and string constants of the part's callable, of what it
+    calls in its class and module, and of its class's __init__ (which may
+    derive attributes from any parameter).
+    """
+    cls = None
+    if '.' in instance:
+        cls_name, method_name = instance.split('.', 1)
+        cls = getattr(module, cls_name)
+        todo = [getattr(cls, method_name), cls.__init__]
+    else:
+        todo = [getattr(module, instance)]
+    names, seen = set(), set()
+    while todo:
+        func = todo.pop()
+        func = func.fget if isinstance(func, property) else getattr(func, '__func__', func)
+        func = inspect.unwrap(func) if callable(func) else func
+        if not isinstance(func, types.FunctionType) or func in seen:
+            continue
+        seen.add(func)
+        found = code_names(func.__code__)
+        names |= found
+        for name in found:
+            if cls is not None and any(name in c.__dict__ for c in cls.__mro__[:-1]):
+                todo.append(inspect.getattr_static(cls, name))
+            elif isinstance(vars(module).get(name), types.FunctionType):
+                todo.append(vars(module)[name])
+    return names
+
+def fan_out(part_reads:dict) -> dict:
+    """{parameter: [parts reading it]} from {part: parameters it read}"""
+    readers = {}
+    for part, names in sorted(part_reads.items()):
+        for name in names:
+            readers.setdefault(name, []).append(part)
+    return dict(sorted(readers.items(), key=lambda item: (-len(item[1]), item[0])))
+
+def affects(names:set, changed_params) -> bool:
+    """Might a part that reads names (see reads) see any of changed_params?"""
+    return any({p, p.replace(' ', '_'), p.replace('_', ' ')} & names for p in changed_params)
@@ -1,19 +1,200 @@
-import sys
-from os.path import dirname, basename, join
+"""Get a model's parts to the slicer as one file.
+
+    cqmodel plate model.py [-o plate.3mf] [--plate 256x256] [-q part=N ...] [--open]
+
+Builds every part once, packs it onto a build plate, as many copies as its
+quantity (-q, or config 'quantities'; see cqmodel.pack), and writes a
+single 3MF (a mesh object per part, placed once per copy), STEP assembly
+(a named part per copy) or .stl, instead of a file per part.
+"""
+
+import argparse
+import math
 import subprocess
-import importlib
+import zipfile
+from os.path import abspath, basename, dirname, join
+from xml.sax.saxutils import escape
+import numpy as np
 import cadquery as cq
+from . import build
+from . import cache
+from . import config as configuration
+from . import mesh
+from . import pack
+from . import params
 
-def open_in_slicer(model_pyfile:str, model_modulename, config:dict) -> None:
-    """Render CQ model into BambuStudio"""
+FORMATS = ('3mf', 'step', 'stl')
 
-    model = importlib.import_module(model_modulename)
+def build_parts(model_pyfile:str, config:dict) -> list:
+    """[(part name, cq.Shape), ...] for the parts that build, with the
+    model's sidecar parameter overrides and the geometry cache"""
+    model_pyfile = abspath(model_pyfile)
+    module, _ = build.load_model(model_pyfile, 0)
+    specs = build.part_specs(module, model_pyfile)
+    class_instances = params.apply(module, specs, params.load(params.sidecar(model_pyfile)) or {})
+    cache_config = cache.from_config(config)
+    geometry_cache = cache.get_cache(*cache_config) if cache_config else None
+    parts = []
+    for instance, stl_filename in specs:
+        model, _ = build.calc_part(module, instance, class_instances, stl_filename,
+                                   geometry_cache)
+        if model is not None:
+            parts.append((build.part_name(stl_filename), build.to_shape(model)))
+    return parts
 
-    model_name = basename(model_pyfile).split('.py', 1)[0]
-    out_name = join(config['out_dir'], model_name + '.step')
-    cq.exporters.export(cq_instance, out_name)
+def lay_out(parts, quantities:dict=None, plate=(256, 256), gap:float=5) -> list:
+    """[(name, part, angle, (dx, dy, dz)), ...]: copies of parts, [(part,
+    cq.Shape), ...], packed as pack.arrange does and sitting on Z=0; copies of
+    a part get numbered names"""
+    vertices = {part: mesh.tessellate(shape, 0.5, 0.5)[0] for part, shape in parts}
+    placements, left = pack.arrange({part: pack.outline(v) for part, v in vertices.items()},
+                                    quantities, plate, gap)
+    for part, count in left.items():
+        print(f'{count} of {part} didn\'t fit on the plate')
+    copies = {}
+    placed = []
+    for part, angle, (dx, dy) in placements:
+        copies[part] = copies.get(part, 0) + 1
+        name = f'{part}-{copies[part]}' if (quantities or {}).get(part, 1) > 1 else part
+        placed.append((name, part, angle, (dx, dy, -float(vertices[part][:, 2].min()))))
+    return placed
+
+_3MF_TYPES = """<?xml version="1.0" encoding="UTF-8"?>
+<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">
+ <Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>
+ <Default Extension="model" ContentType="application/vnd.ms-package.3dmanufacturing-3dmodel+xml"/>
+</Types>
+"""
+_3MF_RELS = """<?xml version="1.0" encoding="UTF-8"?>
+<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">
+ <Relationship Target="/3D/3dmodel.model" Id="rel0" Type="http://schemas.microsoft.com/3dmanufacturing/2013/01/3dmodel"/>
+</Relationships>
+"""
+
+def _write_3mf(out_name:str, meshes:dict, placed:list) -> None:
+    """A 3MF of one object per part, {part: (vertices, triangles)}, and a
+    build item per placed copy, so copies share their part's mesh"""
+    ids = {part: n for n, part in enumerate(meshes, 1)}
+    lines = ['<?xml version="1.0" encoding="UTF-8"?>',
+             '<model unit="millimeter" xml:lang="en-US" '
+             'xmlns="http://schemas.microsoft.com/3dmanufacturing/core/2015/02">',
+             '<resources>']
+    for part, (vertices, triangles) in meshes.items():
+        lines.append(f'<object id="{ids[part]}" name="{escape(part)}" type="model">'
+                     '<mesh><vertices>')
+        lines += [f'<vertex x="{x:.7g}" y="{y:.7g}" z="{z:.7g}"/>' for x, y, z in vertices.tolist()]
+        lines.append('</vertices><triangles>')
+        lines += [f'<triangle v1="{a}" v2="{b}" v3="{c}"/>' for a, b, c in triangles.tolist()]
+        lines.append('</triangles></mesh></object>')
+    lines.append('</resources>')
+    lines.append('<build>')
+    for name, part, angle, (dx, dy, dz) in placed:
+        c, s = math.cos(math.radians(angle)), math.sin(math.radians(angle))
+        transform = ' '.join(f'{v:.6g}' for v in (c, s, 0, -s, c, 0, 0, 0, 1, dx, dy, dz))
+        lines.append(f'<item objectid="{ids[part]}" transform="{transform}"/>')
+    lines.append('</build>')
+    lines.append('</model>')
+    with zipfile.ZipFile(out_name, 'w', zipfile.ZIP_DEFLATED) as z:
+        z.writestr('[Content_Types].xml', _3MF_TYPES)
+        z.writestr('_rels/.rels', _3MF_RELS)
+        z.writestr('3D/3dmodel.model', '\n'.join(lines))
 
-    # subprocess.check_call(['open', out_name])
+def write_plate(parts, placed:list, out_name:str, tessellation:dict) -> None:
+    """One file of the placed copies (see lay_out) of parts, type by
+    out_name's extension; each part is tessellated once"""
+    shapes = dict(parts)
+    if out_name.lower().endswith('.step'):
+        assembly = cq.Assembly(name='plate')
+        for name, part, angle, offset in placed:
+            assembly.add(shapes[part], name=name,
+                         loc=cq.Location(cq.Vector(*offset), cq.Vector(0, 0, 1), angle))
+        assembly.export(out_name, 'STEP')
+        return
+    meshes = {part: mesh.compact(*mesh.tessellate(shapes[part], tessellation['tolerance'],
+                                                  tessellation['angular_tolerance']))
+              for part in dict.fromkeys(part for _, part, _, _ in placed)}
+    if out_name.lower().endswith('.3mf'):
+        _write_3mf(out_name, meshes, placed)
+        return
+    vertices, triangles, count = [], [], 0
+    for name, part, angle, offset in placed:
+        v, t = meshes[part]
+        vertices.append(pack.rotate(v, angle) + offset)
+        triangles.append(t + count)
+        count += len(v)
+    mesh.write_stl(out_name, np.concatenate(vertices), np.concatenate(triangles))
+
+def make_plate(model_pyfile:str, config:dict, out_name:str):
+    """Build the model's parts and write copies of them packed onto one plate
+    (config 'quantities', 'plate', 'plate_gap' and tessellation 'profile');
+    returns the placed copies, or None if no parts built"""
+    parts = build_parts(model_pyfile, config)
+    if not parts:
+        return None
+    unknown = set(config.get('quantities', {})) - {name for name, _ in parts}
+    if unknown:
+        raise ValueError(f'no parts {", ".join(sorted(unknown))} to print copies of')
+    placed = lay_out(parts, config.get('quantities'), config.get('plate', (256, 256)),
+                     config.get('plate_gap', 5))
+    write_plate(parts, placed, out_name,
+                build.tessellation(config, config.get('profile', 'print')))
+    return placed
+
+def open_in_slicer(model_pyfile:str, config:dict) -> str:
+    """Render CQ model's parts onto one plate, <model>.3mf (config
+    'plate_format'), and open it in the slicer (config 'slicer')"""
+    model_name = basename(model_pyfile).split('.py', 1)[0]
+    out_name = join(config.get('out_dir') or dirname(abspath(model_pyfile)),
+                    f'{model_name}.{config.get("plate_format", "3mf")}')
+    if make_plate(model_pyfile, config, out_name) is None:
+        print('No parts built')
+        return None
+    subprocess.Popen([config.get('slicer', 'bambu-studio'), out_name])
 
     # Output on screen includes outfile on last line
+    print(out_name)
+    return out_name
+
+def main(argv) -> int:
+    p = argparse.ArgumentParser(prog='cqmodel plate', description=__doc__.split('\n')[0])
+    p.add_argument('model', help="Python CadQuery model file.py")
+    p.add_argument('--config', '-c', type=str, default=None)
+    p.add_argument('--output', '-o', type=str, default=None,
+                   help=f"Plate file, {' or '.join(FORMATS)} (default: <model>.3mf)")
+    p.add_argument('--plate', type=str, default=None,
+                   help="Build plate size in mm, WIDTHxDEPTH (default 256x256)")
+    p.add_argument('--gap', type=float, default=None, help="mm between parts (default 5)")
+    p.add_argument('--quantity', '-q', action='append', default=[],
+                   help="'part=N': copies of a part to print, repeatable (default 1 each)")
+    p.add_argument('--tessellation', dest='profile', default='print')
+    p.add_argument('--open', action='store_true',
+                   help="Open the plate in the slicer (config 'slicer', default bambu-studio)")
+    a = p.parse_args(argv)
+
+    conf = configuration.load(a.model, a.config)
+    if a.plate:
+        conf['plate'] = tuple(float(d) for d in a.plate.lower().split('x'))
+    if a.gap is not None:
+        conf['plate_gap'] = a.gap
+    for quantity in a.quantity:
+        part, _, count = quantity.partition('=')
+        if not count.isdigit():
+            p.error(f'--quantity "{quantity}" is not part=N')
+        conf.setdefault('quantities', {})[part] = int(count)
+    out_name = a.output or a.model.rsplit('.py', 1)[0] + '.3mf'
+    if out_name.rsplit('.', 1)[-1].lower() not in FORMATS:
+        p.error(f'--output must end in .{" or .".join(FORMATS)}')
 
+    conf['profile'] = a.profile
+    try:
+        placed = make_plate(a.model, conf, out_name)
+    except ValueError as e:
+        p.error(str(e))
+    if placed is None:
+        print('No parts built')
+        return 1
+    print(f'{len(placed)} parts on the plate')
+    if a.open:
+        subprocess.Popen([conf.get('slicer', 'bambu-studio'), out_name])
+    print(out_name)
+    return 0
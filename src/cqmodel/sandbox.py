@@ -0,0 +1,72 @@
+"""Run a part's build in a forked child, so that a segfault, a hang, or a
+runaway allocation in OCCT costs that part instead of the process building
+the rest (the watcher, or a pool worker).
+
+Forking keeps it cheap: the child already has cadquery and the model loaded.
+Linux only, as fork and /proc are.
+"""
+
+import os
+import resource
+import signal
+import sys
+import traceback
+import multiprocessing as mp
+
+class PartFailed(Exception):
+    """The child crashed, ran out of time or memory, or raised"""
+
+def _limit_memory(memory_mb:float) -> None:
+    """Allow memory_mb more address space than the child starts with"""
+    with open('/proc/self/statm', 'r') as f:
+        size = int(f.read().split()[0]) * os.sysconf('SC_PAGE_SIZE')
+    limit = size + int(memory_mb * 1024 * 1024)
+    resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+
+def _child(sender, func, args, memory_mb):
+    try:
+        if memory_mb:
+            _limit_memory(memory_mb)
+        outcome = (True, func(*args))
+    except BaseException as e:
+        traceback.print_exception(e)
+        outcome = (False, repr(e))
+    sender.send(outcome)
+    sender.close()
+
+def _death(exitcode) -> str:
+    if exitcode is not None and exitcode < 0:
+        try:
+            return f'killed by {signal.Signals(-exitcode).name}'
+        except ValueError:
+            pass
+    return f'exited with status {exitcode} and no result'
+
+def run(func, args=(), timeout:float=None, memory_mb:float=None):
+    """func(*args) in a forked child; its return value must pickle.
+
+    timeout is in seconds; memory_mb is address space the child may add to
+    what it inherits.  Raises PartFailed if the child doesn't deliver.
+    """
+    context = mp.get_context('fork')
+    sys.stdout.flush()  # or the child would repeat what's buffered
+    sys.stderr.flush()
+    receiver, sender = context.Pipe(duplex=False)
+    child = context.Process(target=_child, args=(sender, func, args, memory_mb), daemon=True)
+    child.start()
+    sender.close()
+    try:
+        if not receiver.poll(timeout):
+            child.kill()
+            raise PartFailed(f'timed out after {timeout} s')
+        try:
+            ok, value = receiver.recv()
+        except EOFError:  # died without a word
+            child.join()
+            raise PartFailed(_death(child.exitcode)) from None
+    finally:
+        receiver.close()
+        child.join()
+    if not ok:
+        raise PartFailed(value)
+    return value
@@ -0,0 +1,147 @@
+"""Build variants of a model over a grid or list of parameter overrides.
+
+    cqmodel sweep model.py --set 'roller thickness=2,3,4' --set 'leg thickness=3,4'
+    cqmodel sweep model.py --variants variants.json
+
+Each --set gives a parameter and its values; variants are every combination.
+Or --variants names a JSON list of {parameter: value} dicts.  Parameters
+are overridden where the model keeps them; see cqmodel.params.
+
+Variants build in parallel, one per process at a time, into
+<output>/variant-NNN/, sharing the geometry cache so parts a variant doesn't
+change aren't recomputed.  <output>/sweep.csv gets a row per variant and part
+with the overrides, volume, bounding box size and build seconds.
+"""
+
+import argparse
+import ast
+import csv
+import itertools
+import json
+import os
+import time
+import multiprocessing as mp
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from os.path import abspath, basename, join
+from . import config
+from . import params
+from . import validate
+
+def parse_set(setting:str):
+    """'name=v1,v2,...' -> (name, [values]); values as Python literals if they parse"""
+    name, _, values = setting.partition('=')
+    if not name or not values:
+        raise ValueError(f'--set "{setting}" is not name=value,...')
+
+    def literal(v):
+        try:
+            return ast.literal_eval(v.strip())
+        except (ValueError, SyntaxError):
+            return v.strip()
+    return name.strip(), [literal(v) for v in values.split(',')]
+
+def grid(settings) -> list:
+    """Every combination of [(name, [values]), ...], as override dicts"""
+    names = [name for name, _ in settings]
+    return [dict(zip(names, combo))
+            for combo in itertools.product(*(values for _, values in settings))]
+
+def build_variant(model_pyfile:str, number:int, overrides:dict, output_dir:str,
+                  cache_config, options:dict) -> list:
+    """Pool worker entry: build every part of one variant; rows for the CSV"""
+    from . import build
+    from . import cache
+    module, _ = build.load_model(model_pyfile, number)  # fresh PARAMS
+    specs = build.part_specs(module, model_pyfile)
+    class_instances = params.apply(module, specs, overrides)
+    geometry_cache = cache.get_cache(*cache_config) if cache_config else None
+    variant_dir = join(output_dir, f'variant-{number:03d}')
+    os.makedirs(variant_dir, exist_ok=True)
+    rows = []
+    for instance, stl_filename in specs:
+        started = time.perf_counter()
+        stl_filename = join(variant_dir, basename(stl_filename))
+        model, cached = build.calc_part(module, instance, class_instances, stl_filename,
+                                        geometry_cache)
+        row = {'variant': number, 'part': build.part_name(stl_filename), **overrides}
+        if model is None:
+            rows.append(dict(row, error='failed'))
+            continue
+        build.export_part(model, stl_filename, options)
+        shape = build.to_shape(model)
+        box = shape.BoundingBox()
+        rows.append(dict(row, volume=round(shape.Volume(), 3), x=round(box.xlen, 3),
+                         y=round(box.ylen, 3), z=round(box.zlen, 3), cached=cached,
+                         seconds=round(time.perf_counter() - started, 3)))
+    return rows
+
+def main(argv) -> int:
+    p = argparse.ArgumentParser(prog='cqmodel sweep', description=__doc__.split('\n')[0])
+    p.add_argument('model', help="Python CadQuery model file.py")
+    p.add_argument('--set', dest='settings', action='append', default=[],
+                   help="'parameter=value,value,...', repeatable; variants are the grid")
+    p.add_argument('--variants', type=str, default=None,
+                   help="JSON file of a list of {parameter: value} overrides")
+    p.add_argument('--output', '-o', type=str, default='sweep',
+                   help="Directory for variants' parts and sweep.csv (default sweep)")
+    p.add_argument('--config', '-c', type=str, default=None)
+    p.add_argument('--workers', '-j', type=int, default=os.cpu_count())
+    p.add_argument('--format', '-f', dest='formats', action='append', default=None,
+                   help="Output type by extension, repeatable (default: stl)")
+    p.add_argument('--tessellation', dest='profile', default='preview')
+    p.add_argument('--no-cache', action='store_true')
+    a = p.parse_args(argv)
+
+    if a.variants:
+        with open(a.variants, 'r') as f:
+            variants = json.load(f)
+    else:
+        variants = grid([parse_set(s) for s in a.settings])
+    if not variants or variants == [{}]:
+        p.error('nothing to sweep: give --set or --variants')
+    problems = sorted({problem for v in variants for problem in validate.check(a.model, v)})
+    if problems:
+        print('\n'.join(problems))
+        return 1
+
+    from . import build
+    from . import cache
+
+    conf = config.load(a.model, a.config)
+    if a.no_cache:
+        conf['cache'] = False
+    options = {'transport': 'file', 'formats': a.formats or ['stl']}
+    options.update(build.tessellation(conf, a.profile))
+    cache_config = cache.from_config(conf)
+    output_dir = abspath(a.output)
+    os.makedirs(output_dir, exist_ok=True)
+    with open(join(output_dir, 'variants.json'), 'w') as f:
+        json.dump({f'variant-{n:03d}': v for n, v in enumerate(variants, 1)}, f, indent=1)
+
+    print(f'Building {len(variants)} variants in {a.workers} processes')
+    started = time.perf_counter()
+    rows = []
+    lost = 0  # variants that failed whole
+    with ProcessPoolExecutor(max_workers=a.workers,
+                             mp_context=mp.get_context('spawn')) as pool:
+        futures = {pool.submit(build_variant, abspath(a.model), n, v, output_dir,
+                               cache_config, options): n
+                   for n, v in enumerate(variants, 1)}
+        for future in as_completed(futures):
+            try:
+                rows += future.result()
+            except Exception as e:
+                print(f'variant-{futures[future]:03d}: FAILED: {e!r}')
+                lost += 1
+    failed = sum('error' in row for row in rows)
+
+    rows.sort(key=lambda row: (row['variant'], row['part']))
+    fields = (['variant', 'part'] + list(dict.fromkeys(k for v in variants for k in v))
+              + ['volume', 'x', 'y', 'z', 'cached', 'seconds', 'error'])
+    with open(join(output_dir, 'sweep.csv'), 'w', newline='') as f:
+        writer = csv.DictWriter(f, fields)
+        writer.writeheader()
+        writer.writerows(rows)
+    print(f'{len(rows) - failed} parts ok, {failed} failed, {lost} variants failed, '
+          f'{time.perf_counter() - started:.1f} s overall; see {join(a.output, "sweep.csv")}')
+    return 1 if failed or lost else 0
@@ -0,0 +1,80 @@
+"""Where rebuild time goes, per part and phase.
+
+Phases are 'load' (import or reload of the model), 'compute' (the part's
+geometry, or fetching it from the geometry cache), 'tessellate', and
+'export' (writing files).  Code being timed wraps itself in span(); whoever
+ran it take()s the spans, which are plain dicts so pool workers can return
+them with their results.  report() makes a table of them, and write_trace()
+a Chrome trace (chrome://tracing, ui.perfetto.dev) of a whole session.
+"""
+
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+PHASES = ('load', 'compute', 'tessellate', 'export')
+
+_spans = []
+
+@contextmanager
+def span(phase:str, part:str=None):
+    """Time the block as phase of part (None: the model as a whole).
+
+    Yields a dict of details to go along, e.g. whether it was cached.
+    """
+    args = {}
+    started, clock = time.time(), time.perf_counter()
+    try:
+        yield args
+    finally:
+        _spans.append({'phase': phase, 'part': part, 'start': started,
+                       'seconds': time.perf_counter() - clock, 'pid': os.getpid(),
+                       'tid': threading.get_ident(), 'args': args})
+
+def take() -> list:
+    """The spans recorded in this process since last time"""
+    spans = _spans[:]
+    del _spans[:len(spans)]
+    return spans
+
+def add(spans) -> None:
+    """Take spans recorded elsewhere (a sandboxed child) as if recorded here"""
+    _spans.extend(spans)
+
+def report(spans) -> str:
+    """A table of seconds per part and phase, slowest part first"""
+    totals = {}
+    for s in spans:
+        row = totals.setdefault(s['part'] or '(model)', dict.fromkeys(PHASES, 0.0))
+        row[s['phase']] = row.get(s['phase'], 0.0) + s['seconds']
+    if not totals:
+        return ''
+    width = max(len(part) for part in totals)
+    lines = [f'{"part":{width}}' + ''.join(f'{p:>12}' for p in PHASES) + f'{"total":>12}']
+    for part, row in sorted(totals.items(), key=lambda item: -sum(item[1].values())):
+        lines.append(f'{part:{width}}' + ''.join(f'{row[p]:12.3f}' for p in PHASES)
+                     + f'{sum(row.values()):12.3f}')
+    return '\n'.join(lines)
+
+def ops_report(spans, top:int=5) -> str:
+    """The hottest Workplane operations of each part, from util.profile_ops"""
+    lines = []
+    for s in sorted(spans, key=lambda s: -s['seconds']):
+        if s['args'].get('ops'):
+            lines.append(f'{s["part"]}:')
+            for o in s['args']['ops'][:top]:
+                lines.append(f'  {o["op"]:20} {o["where"]:28} {o["calls"]:5}x '
+                             f'{o["seconds"]:9.3f} s')
+    return '\n'.join(lines)
+
+def write_trace(path:str, spans) -> None:
+    """Write spans as a Chrome trace event file, replacing any earlier one"""
+    events = [{'name': f'{s["phase"]} {s["part"] or "(model)"}', 'cat': s['phase'],
+               'ph': 'X', 'ts': s['start'] * 1e6, 'dur': s['seconds'] * 1e6,
+               'pid': s['pid'], 'tid': s['tid'], 'args': dict(s['args'], part=s['part'])}
+              for s in spans]
+    with open(path + '.tmp', 'w') as f:
+        json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f)
+    os.replace(path + '.tmp', path)
@@ -1,11 +1,24 @@
+import functools
+import inspect
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
 import cadquery as cq
 
-def init_params(model, updates):
+def init_params(model, updates, track:bool=None):
     """Transmogrify model's .params dict into individual attributes.
 
     Spaces in .params keys get made into underscores.
 
     updates supplies value overrides, applied as the new attributes.
+
+    With track (by default, only for models made within tracking_params(),
+    as cqmodel's builder makes them), model's attributes also note which
+    parameters get read, for reading_params().  An attribute set later (a
+    derived dimension, say) counts as reading every parameter the model read
+    before it was set.  Tracking makes model's class a generated subclass.
     """
     for param in model.params.keys():
         param_attrname = param.replace(' ', '_')
@@ -18,7 +31,140 @@ def init_params(model, updates):
         else:
             setattr(model, param_attrname, model.params[param])
     if updates:
-        raise RuntimeError(f"Bogus parameter overrides: {join(',', updates.keys())}")
+        raise RuntimeError(f"Bogus parameter overrides: {', '.join(updates.keys())}")
+    _forget(model)
+    if track if track is not None else getattr(_reading, 'track', False):
+        _track_params(model)
+
+class _ParamTracking:
+    """A model's parameter attributes, and the parameters each attribute stands for"""
+
+    def __init__(self, names):
+        self.params = set(names)
+        self.deps = {name: {name} for name in names}
+        self.log = set()  # read outside of reading_params: by __init__, say
+
+_reading = threading.local()
+
+def _tracked_class(cls):
+    """cls's subclass that tracks parameter reads, made once per class"""
+    if getattr(cls, '_tracks_params', False):
+        return cls
+    if '_params_tracked_by' in cls.__dict__:
+        return cls._params_tracked_by
+    base_getattribute, base_setattr = cls.__getattribute__, cls.__setattr__
+
+    def __getattribute__(self, name):
+        value = base_getattribute(self, name)
+        if not name.startswith('__') and name != '_param_tracking':
+            tracking = base_getattribute(self, '_param_tracking')
+            deps = tracking.deps.get(name)
+            if deps:
+                reads = getattr(_reading, 'reads', None)
+                (tracking.log if reads is None else reads).update(deps)
+        return value
+
+    def __setattr__(self, name, value):
+        base_setattr(self, name, value)
+        tracking = base_getattribute(self, '_param_tracking')
+        if name in tracking.params:
+            _forget(self)
+        else:
+            tracking.deps[name] = set(tracking.log)
+
+    cls._params_tracked_by = type(cls.__name__, (cls,), {
+        '__getattribute__': __getattribute__, '__setattr__': __setattr__,
+        '__module__': cls.__module__, '__qualname__': cls.__qualname__,
+        '__doc__': cls.__doc__, '_tracks_params': True})
+    return cls._params_tracked_by
+
+def _track_params(model):
+    object.__setattr__(model, '_param_tracking', _ParamTracking(
+        [param.replace(' ', '_') for param in model.params]))
+    model.__class__ = _tracked_class(type(model))
+
+def tracks_params(model) -> bool:
+    return getattr(type(model), '_tracks_params', False)
+
+def _note_reads(model, names) -> None:
+    """Count names as read now, as __getattribute__ would have"""
+    reads = getattr(_reading, 'reads', None)
+    if reads is not None:
+        reads.update(names)
+    elif tracks_params(model):
+        object.__getattribute__(model, '_param_tracking').log.update(names)
+
+class _Memo:
+    """A model's memoized results: (method name, args) -> (result, parameters read).
+    Not a dict, so cache.part_key leaves it out of the model's attributes."""
+
+    def __init__(self):
+        self.results = {}
+        self.values = ()  # of the parameter attributes, when the results were computed
+
+    def check(self, model) -> None:
+        """Forget the results if a parameter attribute got set since: on a
+        model that doesn't track params, nothing else notices"""
+        names = [param.replace(' ', '_') for param in getattr(model, 'params', None) or ()]
+        values = [vars(model).get(name) for name in names]
+        if len(values) != len(self.values) or any(
+                a is not b for a, b in zip(values, self.values)):
+            self.results.clear()
+            self.values = values
+
+def _forget(model) -> None:
+    if '_memo' in vars(model):
+        object.__getattribute__(model, '_memo').results.clear()
+
+def memoize(method):
+    """Decorate a model method to compute once per instance and arguments.
+
+    For calculations and intermediate geometry several parts share: each part
+    gets the same result object, so it mustn't be changed in place.  Parts
+    still count as reading the parameters the first computation read.
+    Forgotten when init_params runs or a parameter attribute gets set.
+    """
+    @functools.wraps(method)
+    def memoized(self, *args, **kwargs):
+        key = (method.__name__, args, tuple(sorted(kwargs.items())))
+        try:
+            hash(key)
+        except TypeError:
+            return method(self, *args, **kwargs)
+        if '_memo' not in vars(self):
+            object.__setattr__(self, '_memo', _Memo())
+        memo = object.__getattribute__(self, '_memo')
+        memo.check(self)
+        results = memo.results
+        if key not in results:
+            with reading_params() as reads:
+                result = method(self, *args, **kwargs)
+            results[key] = (result, reads)
+        result, reads = results[key]
+        _note_reads(self, reads)
+        return result
+    return memoized
+
+@contextmanager
+def tracking_params():
+    """Have init_params track parameter reads of models made in the block"""
+    outer = getattr(_reading, 'track', False)
+    _reading.track = True
+    try:
+        yield
+    finally:
+        _reading.track = outer
+
+@contextmanager
+def reading_params():
+    """Collect, in the yielded set, the attribute names of parameters read
+    in the block from models set up by init_params"""
+    outer = getattr(_reading, 'reads', None)
+    _reading.reads = reads = set()
+    try:
+        yield reads
+    finally:
+        _reading.reads = outer
 
 def infoize():
     """Monkeypatch in the info str() fns from primer.html in CQ docs"""
@@ -45,3 +191,49 @@ def infoize():
         out += f"  modelling context: {self.ctx}"
         return out
     cq.Workplane.__str__ = _wp_str
+
+# Workplane operation profile: (op, file, line) -> [calls, seconds]
+_op_stats = {}
+_op_depth = threading.local()
+
+def profile_ops():
+    """Monkeypatch cq.Workplane methods to time each call from model code.
+
+    Only the outermost call counts (fillet's own inner Workplane calls are
+    part of fillet), keyed by method and the source line calling it.
+    take_op_profile() collects.  Idempotent.
+    """
+    if getattr(cq.Workplane, '_cqmodel_profiled', False):
+        return
+    cq.Workplane._cqmodel_profiled = True
+
+    def timed(name, method):
+        @functools.wraps(method)
+        def wrapper(*args, **kwargs):
+            depth = getattr(_op_depth, 'n', 0)
+            if depth:
+                return method(*args, **kwargs)
+            caller = sys._getframe(1)
+            key = (name, caller.f_code.co_filename, caller.f_lineno)
+            _op_depth.n = 1
+            started = time.perf_counter()
+            try:
+                return method(*args, **kwargs)
+            finally:
+                _op_depth.n = 0
+                stats = _op_stats.setdefault(key, [0, 0.0])
+                stats[0] += 1
+                stats[1] += time.perf_counter() - started
+        return wrapper
+
+    for name, method in list(vars(cq.Workplane).items()):
+        if not name.startswith('_') and inspect.isfunction(method):
+            setattr(cq.Workplane, name, timed(name, method))
+
+def take_op_profile() -> list:
+    """[{'op', 'where', 'calls', 'seconds'}, ...] recorded since last time, slowest first"""
+    ops = [{'op': op, 'where': f'{os.path.basename(filename)}:{line}',
+            'calls': calls, 'seconds': seconds}
+           for (op, filename, line), (calls, seconds) in _op_stats.items()]
+    _op_stats.clear()
+    return sorted(ops, key=lambda o: -o['seconds'])
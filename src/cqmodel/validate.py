@@ -0,0 +1,166 @@
+"""Quick checks of a model before building it, from its source alone.
+
+    cqmodel check model.py ...
+
+Finds, in milliseconds and without importing the model or cadquery: syntax
+errors; a missing instance()/instances(); instances() names that don't
+resolve to a top-level function or a method of a top-level class; parameter
+overrides no parameter takes; and environment variables read without
+float()/int() (or str()), so kept as strings, or set to something that isn't
+the number the model parses.
+"""
+
+import argparse
+import ast
+import os
+from . import params
+
+def env_read(node):
+    """The variable name if node is os.environ.get('X', ...), os.getenv('X'), or os.environ['X']"""
+    if isinstance(node, ast.Call) and node.args and isinstance(node.args[0], ast.Constant):
+        f = node.func
+        if (isinstance(f, ast.Attribute) and f.attr in ('get', 'getenv')
+                and ast.unparse(f.value) in ('os.environ', 'environ', 'os')):
+            return node.args[0].value
+    elif (isinstance(node, ast.Subscript) and ast.unparse(node.value) in ('os.environ', 'environ')
+            and isinstance(node.slice, ast.Constant)):
+        return node.slice.value
+    return None
+
+# Calls that take an environment variable's string as what it is
+_STRING_CALLS = ('float', 'int', 'str', 'bool', 'len', 'Path')
+
+def _string_use(node, parent) -> bool:
+    """Whether parent uses node's value as the string it is, converting it or
+    not keeping it: float() it, say, or compare it, but not store it in PARAMS"""
+    if isinstance(parent, ast.Call):
+        return node in parent.args and (isinstance(parent.func, ast.Attribute)  # os.path.join
+                                        or ast.unparse(parent.func) in _STRING_CALLS)
+    if isinstance(parent, (ast.If, ast.While, ast.IfExp, ast.Assert)):
+        return node is parent.test
+    return isinstance(parent, (ast.Attribute, ast.Compare, ast.FormattedValue, ast.Expr))
+
+def _check_env(tree, where) -> list:
+    problems = []
+    parents = {child: node for node in ast.walk(tree) for child in ast.iter_child_nodes(node)}
+    for node in ast.walk(tree):
+        name = env_read(node)
+        if not isinstance(name, str):
+            continue
+        parent = parents.get(node)
+        if not _string_use(node, parent):
+            problems.append(f'{where(node)}: environment variable {name} is a string; '
+                            f'float() it (or str() it, if a string is meant)')
+        elif (isinstance(parent, ast.Call) and isinstance(parent.func, ast.Name)
+                and parent.func.id in ('float', 'int') and name in os.environ):
+            try:
+                {'float': float, 'int': int}[parent.func.id](os.environ[name])
+            except ValueError:
+                problems.append(f'{where(node)}: environment variable {name}='
+                                f'{os.environ[name]!r} is not {parent.func.id}')
+    return problems
+
+def _instances(tree):
+    """The names instances() returns, if it's a plain list of strings, else None"""
+    for node in tree.body:
+        if isinstance(node, ast.FunctionDef) and node.name == 'instances':
+            for statement in node.body:
+                if (isinstance(statement, ast.Return)
+                        and isinstance(statement.value, (ast.List, ast.Tuple))
+                        and all(isinstance(e, ast.Constant) and isinstance(e.value, str)
+                                for e in statement.value.elts)):
+                    return [(e.value, e) for e in statement.value.elts]
+    return None
+
+def _methods(classes:dict, name:str, seen=()) -> set:
+    """Method names of top-level class name, with same-module bases'; None if unknowable"""
+    methods = {n.name for n in classes[name].body
+               if isinstance(n, (ast.FunctionDef, ast.AsyncFunctionDef))}
+    methods |= {target.id for n in classes[name].body if isinstance(n, ast.Assign)
+                for target in n.targets if isinstance(target, ast.Name)}
+    for base in classes[name].bases:
+        if isinstance(base, ast.Name) and base.id in classes and base.id not in seen:
+            inherited = _methods(classes, base.id, seen + (name,))
+            if inherited is None:
+                return None
+            methods |= inherited
+        elif not (isinstance(base, ast.Name) and base.id == 'object'):
+            return None
+    return methods
+
+def _param_names(tree, classes:dict):
+    """Names overrides can take (see params.apply), or None if unknowable"""
+    names = set()
+    for node in tree.body:
+        if isinstance(node, ast.Assign) and any(isinstance(t, ast.Name) and t.id == 'PARAMS'
+                                                for t in node.targets):
+            if not isinstance(node.value, ast.Dict):
+                return None
+            names |= {k.value for k in node.value.keys if isinstance(k, ast.Constant)}
+        elif isinstance(node, ast.ClassDef) and node.name == 'PARAMS':
+            names |= _methods(classes, 'PARAMS') or set()
+    for cls in classes.values():
+        init = next((n for n in cls.body if isinstance(n, ast.FunctionDef)
+                     and n.name == '__init__'), None)
+        if init is None or 'params' not in [a.arg for a in init.args.args]:
+            continue
+        for node in ast.walk(init):
+            if (isinstance(node, ast.Assign) and len(node.targets) == 1
+                    and ast.unparse(node.targets[0]) == 'self.params'):
+                if isinstance(node.value, ast.Dict):
+                    names |= {k.value for k in node.value.keys if isinstance(k, ast.Constant)}
+                elif not (isinstance(node.value, ast.Name) and node.value.id == 'PARAMS'):
+                    return None
+    return {n.replace(' ', '_') for n in names if isinstance(n, str)}
+
+def check(model_pyfile:str, overrides:dict=None) -> list:
+    """Problems found with the model, as 'file:line: message' strings"""
+    name = os.path.basename(model_pyfile)
+    try:
+        with open(model_pyfile, 'r') as f:
+            tree = ast.parse(f.read(), model_pyfile)
+    except SyntaxError as e:
+        return [f'{name}:{e.lineno}: {e.msg}']
+    except OSError as e:
+        return [f'{name}: {e.strerror}']
+
+    def where(node):
+        return f'{name}:{node.lineno}'
+
+    functions = {n.name for n in tree.body if isinstance(n, (ast.FunctionDef, ast.AsyncFunctionDef))}
+    classes = {n.name: n for n in tree.body if isinstance(n, ast.ClassDef)}
+    problems = []
+    if not functions & {'instance', 'instances'}:
+        problems.append(f'{name}: defines neither instance() nor instances()')
+    for instance, node in _instances(tree) or []:
+        if '.' in instance:
+            cls_name, method_name = instance.split('.', 1)
+            if cls_name not in classes:
+                problems.append(f'{where(node)}: no class {cls_name} for "{instance}"')
+                continue
+            methods = _methods(classes, cls_name)
+            if methods is not None and method_name not in methods:
+                problems.append(f'{where(node)}: {cls_name} has no method {method_name}')
+        elif instance not in functions:
+            problems.append(f'{where(node)}: no function {instance}')
+    if overrides:
+        names = _param_names(tree, classes)
+        if names is not None:
+            bogus = [o for o in overrides if o.replace(' ', '_') not in names]
+            if bogus:
+                problems.append(f'{name}: no parameters {", ".join(bogus)} to override')
+    problems += _check_env(tree, where)
+    return problems
+
+def main(argv) -> int:
+    p = argparse.ArgumentParser(prog='cqmodel check', description=__doc__.split('\n')[0])
+    p.add_argument('models', nargs='+', help="Python CadQuery model files")
+    a = p.parse_args(argv)
+    failed = 0
+    for model in a.models:
+        overrides = params.load(params.sidecar(model))
+        problems = check(model, overrides)
+        for problem in problems:
+            print(problem)
+        failed += bool(problems)
+    return 1 if failed else 0
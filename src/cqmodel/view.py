@@ -6,15 +6,36 @@ Ripped examples from:
 """
 
 import multiprocessing as mp
+import asyncio
 import importlib
+import threading
 import traceback
 import time
 import sys
 import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, wait, FIRST_COMPLETED
+from concurrent.futures.process import BrokenProcessPool
 from functools import partial
-from os.path import dirname, basename, join
-import cadquery as cq
-from .viewer import view_stl
+from os.path import abspath, dirname, basename
+from . import build
+from . import cache
+from . import mesh
+from . import pack
+from . import params
+from . import timing
+from . import util
+from . import validate
+from . import watch
+from .viewer import view_stl, view_stls
+
+def _release_abandoned(future):
+    """Done callback for builds nobody wants anymore: free their meshes"""
+    try:
+        descriptor = future.result()['mesh']
+    except Exception:
+        return
+    if descriptor is not None:
+        mesh.release(descriptor)
 
 class ModelVisualizer:
     """Writes .stl for each item in a CadQuery model, and repeats on input changes."""
@@ -24,6 +45,12 @@ class ModelVisualizer:
         model_modulename is ignored, prep to calc it by convention
         """
         self.mp_context = mp.get_context('spawn')
+        # Viewers fork from a server that has loaded only VTK, not cadquery
+        if 'forkserver' in mp.get_all_start_methods():
+            self._viewer_context = mp.get_context('forkserver')
+            self._viewer_context.set_forkserver_preload(['cqmodel.viewer'])
+        else:
+            self._viewer_context = self.mp_context
         self.model_pyfile = model_pyfile
         self.config = config
 
@@ -31,68 +58,219 @@ class ModelVisualizer:
         if dirname(model_pyfile) not in sys.path:
             sys.path.insert(0, dirname(model_pyfile))
         self.model_module = importlib.import_module(self.model_modulename)
-        self._mtime = os.stat(model_pyfile).st_mtime
         self._viewers = {}
+        self._loop = None  # set while run_async is running
+        self._window_stls = set()  # shown in the single window, if that's the mode
+        self._queues = {}  # viewer key -> queue of updates for it
+        self._meshes = {}  # stl filename -> shared memory mesh we own
+        self._options = {'transport': config.get('transport', 'file'),
+                         'write_stl': config.get('write_stl', True),
+                         'formats': [config.get('mesh_format', 'stl')]}
+        self._options.update(build.tessellation(config, config.get('profile', 'preview')))
+        if config.get('profile_ops'):
+            self._options['profile_ops'] = True
+            util.profile_ops()
+        if config.get('sandbox') or config.get('part_timeout') or config.get('part_memory_mb'):
+            self._options['sandbox'] = {'timeout': config.get('part_timeout'),
+                                        'memory_mb': config.get('part_memory_mb')}
+        self._generation = 0
+        self._rebuilds = 0  # stamped into files written, with our pid (see mesh.stamp)
+        self._workers = config.get('workers', 0)  # 0 computes parts in this process
+        self._executor = None
+        if self._workers:
+            self._warm_pool()
+        self._cache_config = cache.from_config(config)
+        self._cache = cache.get_cache(*self._cache_config) if self._cache_config else None
+        self._trace = []  # spans of the whole session, if config 'trace' names a file
+        self._params_file = params.sidecar(model_pyfile)
+        self._overrides = params.load(self._params_file) or {}
+        self._built_overrides = {}  # as of the last rebuild that finished
+        self.param_reads = {}  # part name -> parameters it read when last computed
 
     def __del__(self):
+        if self._executor is not None:
+            self._executor.shutdown(cancel_futures=True)
         for viewer in self._viewers.keys():
             self._viewers[viewer].terminate()  # die while leaving .stl in place
             self._viewers[viewer].join()  # wait for it to finish dying. Why? Zombies?
+        for descriptor in self._meshes.values():
+            mesh.release(descriptor)
+
+    def _pool(self):
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self._workers,
+                                                 mp_context=self.mp_context,
+                                                 initializer=build.warm,
+                                                 initargs=(time.time(),))
+        return self._executor
+
+    def _warm_pool(self):
+        """Start every pool worker now, so they're warm for the first rebuild.
+
+        Workers live as long as the pool, keeping cadquery loaded across rebuilds.
+        """
+        for _ in range(self._workers):
+            self._pool().submit(os.getpid)  # each submit starts another worker
+
+    def _part_specs(self) -> list:
+        """build.part_specs, the files named for the format viewers read"""
+        fmt = self._options.get('formats', ['stl'])[0]
+        return [(instance, stl_filename.rsplit('.', 1)[0] + '.' + fmt) for instance, stl_filename
+                in build.part_specs(self.model_module, self.model_pyfile)]
 
-    def _calc_model(self, callable, stls, stl_filename):
+    def write_stls(self, on_stl=None, cancel=None, only=None):
+        """Re-import model, write out stl files, and return an iterable of their names
+
+        on_stl, if given, gets called with each stl filename as soon as it's written,
+        along with its shared memory mesh descriptor (None unless transport 'shm').
+        cancel, a threading.Event, abandons the rebuild between parts when set;
+        then the return is None.  only, a set of instance names, recomputes just
+        those parts with the current parameter overrides, without re-importing.
+        Also None if the model fails validate.check: nothing gets built.
+        """
+        problems = validate.check(self.model_pyfile, self._overrides)
+        if problems:
+            print('\n'.join(problems))
+            return None
+        timing.take()  # anything left from an abandoned rebuild
+        self._rebuilds += 1
+        self._options['rebuild'] = f'{os.getpid()}.{self._rebuilds}'
+        if only is None:
+            with timing.span('load'):
+                self.model_module = build.reload_model(self.model_module)
+            self._generation += 1
+        specs = self._part_specs()
         try:
-            model = callable()
+            class_instances = params.apply(self.model_module, specs, self._overrides)
         except Exception as e:
-            print(f'Trouble with model "{stl_filename.split(".", 1)[0]}"')
-            traceback.print_exception(e)
-            try:
-                stls.remove(stl_filename)
-            except KeyError:
-                pass
-            return None
-        stls.add(stl_filename)
-        return model
-
-
-    def write_stls(self):
-        """Re-import model, write out stl files, and return an iterable of their names"""
-        self.model_module = importlib.reload(self.model_module)
-        stls = set()
-        if getattr(self.model_module, 'instance', None):
-            stl_filename = self.model_pyfile.replace(".py", ".stl")
-            call_to_compute = self.model_module.instance
-            model = self._calc_model(call_to_compute, stls, stl_filename)
-            if model:
-                cq.exporters.export(model, stl_filename)
-            else:
-                pass  # failure is presented to user by disappearance of viewer window
-        elif getattr(self.model_module, 'instances'):
-            class_instances = {}
-            stls = set()
-            for instance in self.model_module.instances():
-                if '.' in instance:  # "class.method"
-                    cls_name, method_name = instance.split('.', 1)
-                    if cls_name in class_instances:
-                        class_instance = class_instances[cls_name]
-                    else:
-                        class_instance = getattr(self.model_module, cls_name)()
-                        class_instances[cls_name] = class_instance
-                    stl_filename = join(dirname(self.model_pyfile), f'{method_name}.stl')
-                    call_to_compute = getattr(class_instance, method_name)
-                else:  # "function"
-                    stl_filename = join(dirname(self.model_pyfile), f'{instance}.stl')
-                    call_to_compute = getattr(self.model_module, instance)
-                model = self._calc_model(call_to_compute, stls, stl_filename)
-                if model:
-                    cq.exporters.export(model, stl_filename)
+            print(f'Ignoring {basename(self._params_file)}: {e!r}')
+            self._overrides = {}
+            class_instances = params.apply(self.model_module, specs, self._overrides)
+        stls = {stl_filename for instance, stl_filename in specs  # as they were
+                if only is not None and instance not in only
+                and (os.path.isfile(stl_filename) or stl_filename in self._meshes)}
+        specs = [(i, s) for i, s in specs if only is None or i in only]
+        hits = 0
+        spans = []  # from workers
+        if self._workers:
+            futures = [
+                self._pool().submit(build.build_part, self.model_pyfile,
+                                    instance, stl_filename, self._generation,
+                                    self._cache_config, self._options, None,
+                                    self._overrides)
+                for instance, stl_filename in specs
+            ]
+            pending = set(futures)
+            while pending:
+                done, pending = wait(pending, timeout=0.1, return_when=FIRST_COMPLETED)
+                for future in done:
+                    try:
+                        result = future.result()
+                    except Exception as e:  # worker died, or result didn't pickle
+                        traceback.print_exception(e)
+                        if isinstance(e, BrokenProcessPool):
+                            self._executor = None  # a fresh one next time
+                        continue
+                    stl_filename, descriptor = result['stl'], result['mesh']
+                    hits += result['cached']
+                    spans += result['spans']
+                    if stl_filename:
+                        stls.add(stl_filename)
+                        if on_stl:
+                            on_stl(stl_filename, descriptor)
+                        elif descriptor is not None:
+                            mesh.release(descriptor)  # nobody to show it
+                    # else failure is presented to user by disappearance of viewer window
+                if cancel is not None and cancel.is_set():
+                    for future in pending:
+                        if not future.cancel():  # already running: finishes unheeded
+                            future.add_done_callback(_release_abandoned)
+                    return None
+        else:
+            for instance, stl_filename in specs:
+                if cancel is not None and cancel.is_set():
+                    return None
+                result = build.build_one(self.model_module, instance, class_instances,
+                                         stl_filename, self._cache, self._options)
+                hits += result['cached']
+                if result['stl'] is not None:
+                    descriptor = result['mesh']
+                    stls.add(stl_filename)
+                    if on_stl:
+                        on_stl(stl_filename, descriptor)
+                    elif descriptor is not None:
+                        mesh.release(descriptor)  # nobody to show it
                 else:
                     # Visually present failure? Yellow background? How to signal?
                     pass
         print(stls)
+        if self._cache_config:
+            print(f'cache: {hits} hit, {len(specs) - hits} miss')
+        spans += timing.take()
+        for span in spans:
+            if 'params' in span['args']:
+                self.param_reads[span['part']] = set(span['args']['params'])
+        self._report(spans)
+        if self.config.get('plate_on_save'):
+            self._write_plate(stls)
+        self._built_overrides = dict(self._overrides)
         return stls
 
-    def converge_viewers(self, stls):
-        """Make sure a viewer is running for each .stl file in stls, and no extras."""
+    def _write_plate(self, stls) -> None:
+        """Pack the parts' files onto one plate .stl, per config 'quantities',
+        'plate' and 'plate_gap' (see pack); config 'plate_on_save' names it,
+        or it's <model>-plate.stl"""
+        started = time.perf_counter()
+        meshes = {}
+        for stl_filename in sorted(stls):
+            try:
+                meshes[build.part_name(stl_filename)] = mesh.read(stl_filename)
+            except (OSError, ValueError) as e:  # shared memory only, or not binary
+                print(f'Leaving {basename(stl_filename)} off the plate: {e}')
+        (vertices, triangles), left = pack.plate_mesh(
+            meshes, self.config.get('quantities'), plate=self.config.get('plate', (256, 256)),
+            gap=self.config.get('plate_gap', 5))
+        for part, count in left.items():
+            print(f'{count} of {part} didn\'t fit on the plate')
+        plate_file = self.config['plate_on_save']
+        if not isinstance(plate_file, str):
+            plate_file = self.model_pyfile.rsplit('.py', 1)[0] + '-plate.stl'
+        mesh.write_stl(plate_file, vertices, triangles)
+        print(f'{basename(plate_file)}: packed in {time.perf_counter() - started:.2f} s')
+
+    def _report(self, spans):
+        """Print where the rebuild's time went, and add it to any trace file"""
+        if self.config.get('timing', True):
+            print(timing.report(spans))
+        if self.config.get('profile_ops'):
+            print(timing.ops_report(spans))
+        if self.config.get('param_fan_out'):
+            for name, parts in params.fan_out(self.param_reads).items():
+                print(f'{name:40} {len(parts):3}  {" ".join(parts)}')
+        if self.config.get('trace'):
+            self._trace += spans
+            timing.write_trace(self.config['trace'], self._trace)
+
+    def export(self, profile:str=None):
+        """Write every part's .stl once, finely tessellated for printing"""
+        preview_options = self._options
+        self._options = {'transport': 'file', 'write_stl': True,
+                         'profile_ops': preview_options.get('profile_ops', False),
+                         'sandbox': preview_options.get('sandbox')}
+        self._options.update(build.tessellation(
+            self.config, profile or self.config.get('export_profile', 'print')))
+        try:
+            return self.write_stls()
+        finally:
+            self._options = preview_options
+
+    def converge_viewers(self, stls, prune=True):
+        """Make sure a viewer is running for each .stl file in stls, and no extras.
+
+        With prune=False, just start what's missing: stls is only part of the set.
+        """
+        if self.config.get('single_window'):
+            return self._converge_window(stls, prune)
 
         # Clean up viewers that died, maybe err'd out, maybe user killed
         for s in list(self._viewers.keys()):
@@ -101,38 +279,213 @@ class ModelVisualizer:
                 del self._viewers[s]
 
         needed = stls - self._viewers.keys()
-        extraneous = set(self._viewers.keys()) - stls
+        extraneous = set(self._viewers.keys()) - stls if prune else set()
         for stl_file in extraneous:
-            os.unlink(stl_file)  # and expect viewer to notice and exit
-            self._viewers[stl_file].join()
-            del self._viewers[stl_file]
+            self._drop_part(stl_file)  # and expect viewer to notice and exit
+            p = self._viewers.pop(stl_file)
+            self._queues.pop(stl_file, None)
+            if self._loop is None:
+                p.join()
+            # else its _reap_viewer task does the waiting
         for stl_file in needed:
-            if os.path.isfile(stl_file):
-                p = mp.Process(target=view_stl, args=(stl_file,))
+            if os.path.isfile(stl_file) or stl_file in self._meshes:
+                updates = None
+                if self._options['transport'] == 'shm':
+                    updates = self._queues[stl_file] = self._viewer_context.Queue()
+                p = self._viewer_context.Process(
+                    target=view_stl,
+                    args=(stl_file, time.time(), updates,
+                          {stl_file: self._meshes[stl_file]} if stl_file in self._meshes else None,
+                          self._viewer_config()))
                 p.start()
                 self._viewers[stl_file] = p
+                if self._loop is not None:
+                    self._loop.create_task(self._reap_viewer(stl_file, p))
             else:
                 print(f'Expected {stl_file} but no.')
 
+    def _viewer_config(self) -> dict:
+        """What of config viewers go by"""
+        return {k: self.config[k] for k in ('layout', 'watch', 'lod_triangles', 'lod_rate')
+                if k in self.config}
+
+    def _converge_window(self, stls, prune):
+        """Like converge_viewers, but all parts go to one window/process"""
+        p = self._viewers.get(self.model_pyfile)
+        if p is not None and not p.is_alive():
+            p.join()
+            del self._viewers[self.model_pyfile]
+            p = None
+        if prune:
+            for stl_file in self._window_stls - stls:
+                self._drop_part(stl_file)  # and expect viewer to notice and drop it
+            self._window_stls = set(stls)
+        else:
+            self._window_stls |= stls
+        shown = sorted(s for s in self._window_stls
+                       if os.path.isfile(s) or s in self._meshes)
+        if p is not None:
+            self._queues[self.model_pyfile].put(shown)
+        elif shown:
+            updates = self._queues[self.model_pyfile] = self._viewer_context.Queue()
+            p = self._viewer_context.Process(
+                target=view_stls,
+                args=(shown, time.time(), updates, self._viewer_config(),
+                      {s: self._meshes[s] for s in shown if s in self._meshes}))
+            p.start()
+            self._viewers[self.model_pyfile] = p
+            if self._loop is not None:
+                self._loop.create_task(self._reap_viewer(self.model_pyfile, p))
+
+    def _drop_part(self, stl_filename):
+        """A part is no more: remove its .stl and mesh, telling its viewer"""
+        if os.path.isfile(stl_filename):
+            os.unlink(stl_filename)
+        descriptor = self._meshes.pop(stl_filename, None)
+        if descriptor is not None:
+            self._send(stl_filename, {stl_filename: None})
+            mesh.release(descriptor)
+
+    def _send(self, stl_filename, update):
+        key = self.model_pyfile if self.config.get('single_window') else stl_filename
+        p = self._viewers.get(key)
+        if p is not None and p.is_alive() and key in self._queues:
+            self._queues[key].put(update)
+
+    def _publish(self, stl_filename, descriptor):
+        """Take ownership of a part's new mesh and send it to its viewer"""
+        old = self._meshes.get(stl_filename)
+        self._meshes[stl_filename] = descriptor
+        self._send(stl_filename, {stl_filename: descriptor})
+        if old is not None:
+            mesh.release(old)  # viewers that have it mapped keep it
+
+    def _converge_one(self, stl_filename, descriptor=None):
+        if descriptor is not None:
+            self._publish(stl_filename, descriptor)
+        self.converge_viewers({stl_filename}, prune=False)
+
+    def _watch_paths(self):
+        # Model's imports and assets may differ after each reload
+        return watch.model_paths(self.model_module) + [self._params_file]
+
+    def _parts_to_rebuild(self, changed_paths):
+        """Take any new overrides from the sidecar file.  Return None if the
+        model needs reloading, else the instances that read parameters
+        changed since the last rebuild"""
+        if self._params_file in changed_paths:
+            overrides = params.load(self._params_file)
+            if overrides is not None:  # else keep what's showing until it's fixed
+                self._overrides = overrides
+        if set(changed_paths) - {self._params_file}:
+            return None
+        changed_params = params.changed(self._built_overrides, self._overrides)
+        only = set()
+        for instance, stl_filename in build.part_specs(self.model_module, self.model_pyfile):
+            names = self.param_reads.get(build.part_name(stl_filename))
+            if names is None:
+                names = params.reads(self.model_module, instance)
+            if params.affects(names, changed_params):
+                only.add(instance)
+        print(f'Parameters {", ".join(sorted(changed_params))} changed: '
+              f'rebuilding {", ".join(sorted(only)) or "nothing"}')
+        return only
+
     def run_sync(self):
+        watcher = watch.watcher(self._watch_paths(), self.config.get('watch'))
+        only = None
         while True:
-            new_filenames = self.write_stls()
-            self.converge_viewers(new_filenames)
-            while True:
-                time.sleep(0.1)
-                new_mtime = os.stat(self.model_pyfile).st_mtime
-                if new_mtime != self._mtime:
-                    self._mtime = new_mtime
-                    break
+            new_filenames = self.write_stls(on_stl=self._converge_one, only=only)
+            if new_filenames is not None:
+                self.converge_viewers(new_filenames)
+            watcher.set_paths(self._watch_paths())
+            only = self._parts_to_rebuild(watcher.wait())
+
+    async def _reap_viewer(self, stl_file, p):
+        """Wait for a viewer process to exit, without blocking the loop"""
+        exited = asyncio.Event()
+        try:
+            self._loop.add_reader(p.sentinel, exited.set)
+        except (NotImplementedError, ValueError):  # no fd-based waiting here
+            await self._loop.run_in_executor(None, p.join)
+        else:
+            try:
+                await exited.wait()
+            finally:
+                self._loop.remove_reader(p.sentinel)
+        p.join()
+        if self._viewers.get(stl_file) is p:
+            del self._viewers[stl_file]
+
+    async def _rebuild(self, cancel, only=None):
+        """Run write_stls off the loop; return its stls, or None if superseded"""
+        def on_stl(stl_filename, descriptor):
+            self._loop.call_soon_threadsafe(self._converge_one, stl_filename, descriptor)
+        return await self._loop.run_in_executor(
+            self._build_thread, partial(self.write_stls, on_stl=on_stl, cancel=cancel,
+                                        only=only))
 
     async def run_async(self):
-        while True:
-            new_filenames = self.write_stls()
-            self.converge_viewers(new_filenames)
+        """Rebuild on changes, latest save wins.
+
+        A save arriving while a rebuild is in progress cancels that rebuild
+        (between parts: a part already computing can't be interrupted) and
+        starts over once saves have been quiet for conf 'debounce' seconds.
+        """
+        self._loop = asyncio.get_running_loop()
+        self._build_thread = ThreadPoolExecutor(max_workers=1)
+        debounce = self.config.get('debounce', 0.05)
+        watcher = watch.watcher(self._watch_paths(), self.config.get('watch'))
+        changed = asyncio.Event()
+        changed_paths = {abspath(self.model_pyfile)}  # since the last finished rebuild
+
+        def on_readable():
+            paths = watcher.poll()
+            if paths:
+                changed_paths.update(paths)
+                changed.set()
+
+        async def poll_forever():
             while True:
-                await anyio.sleep(0.1)
-                new_mtime = os.state(self.model_pyfile).st_mtime
-                if new_mtime != self._mtime:
-                    self._mtime = new_mtime
-                    break
+                await asyncio.sleep(watcher.interval)
+                on_readable()
 
+        if watcher.fileno() is not None:
+            self._loop.add_reader(watcher.fileno(), on_readable)
+            poller = None
+        else:
+            poller = self._loop.create_task(poll_forever())
+        try:
+            while True:
+                cancel = threading.Event()
+                handled = set(changed_paths)
+                rebuild = self._loop.create_task(
+                    self._rebuild(cancel, self._parts_to_rebuild(handled)))
+                changed.clear()
+                changed_wait = self._loop.create_task(changed.wait())
+                await asyncio.wait({rebuild, changed_wait}, return_when=asyncio.FIRST_COMPLETED)
+                if rebuild.done():
+                    changed_wait.cancel()
+                    new_filenames = rebuild.result()
+                    if new_filenames is not None:
+                        self.converge_viewers(new_filenames)
+                        changed_paths.difference_update(handled)
+                    watcher.set_paths(self._watch_paths())
+                    await changed.wait()
+                else:
+                    cancel.set()  # superseded; let it get out of the way
+                    await rebuild
+                    watcher.set_paths(self._watch_paths())
+                while True:  # debounce: wait out a burst of saves
+                    changed.clear()
+                    try:
+                        await asyncio.wait_for(changed.wait(), debounce)
+                    except asyncio.TimeoutError:
+                        break
+        finally:
+            if poller is not None:
+                poller.cancel()
+            elif watcher.fileno() is not None:
+                self._loop.remove_reader(watcher.fileno())
+            self._build_thread.shutdown(wait=False)
+            self._loop = None
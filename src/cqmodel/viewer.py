@@ -1,89 +1,363 @@
 import argparse
+import math
+import queue
 import sys
 import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
 import vtkmodules.vtkInteractionStyle
 import vtkmodules.vtkRenderingOpenGL2
 from vtkmodules.vtkCommonColor import vtkNamedColors
-from vtkmodules.vtkFiltersSources import vtkCylinderSource
+from vtkmodules.vtkCommonCore import vtkPoints
+from vtkmodules.vtkCommonDataModel import vtkCellArray, vtkPolyData
+from vtkmodules.vtkFiltersCore import vtkQuadricDecimation
+from vtkmodules.util.numpy_support import numpy_to_vtk, numpy_to_vtkIdTypeArray
 from vtkmodules.vtkRenderingCore import (
-    vtkActor,
     vtkPolyDataMapper,
     vtkRenderWindow,
     vtkRenderWindowInteractor,
     vtkRenderer
 )
 from vtkmodules.vtkIOGeometry import vtkSTLReader
+from vtkmodules.vtkRenderingLOD import vtkLODActor
+from .watch import watcher
+from . import mesh
+
+LOD_TRIANGLES = 50000  # parts with more get decimated stand-ins while the view moves
 
 class Viewer:
-    def __init__(self, stl_name:str, config:dict):
-        self._stl_name = stl_name
+    """Show .stl (or mesh .npz) files in one window, reloading each as it changes.
+
+    Given one .stl the window goes away with the file.  Given several, they
+    render as separate actors laid out per config 'layout', 'grid' (side by
+    side) or 'assembled' (as modeled); parts whose files go away drop out, and
+    lists of names arriving on the updates queue replace the set.
+
+    Parts can come as shared memory meshes instead of files: dicts of
+    {stl name: mesh descriptor} on the updates queue (or initially, meshes)
+    bring new meshes, a None descriptor meaning the part is gone.
+
+    Parts of more than config 'lod_triangles' triangles (0 for none) get
+    decimated levels of detail, made in the background, which VTK draws
+    instead while the view moves, to keep config 'lod_rate' frames a second;
+    at rest, parts are drawn in full.
+    """
+
+    def __init__(self, stl_names, config:dict, launched:float=None, updates=None,
+                 meshes:dict=None):
+        if isinstance(stl_names, str):
+            stl_names = [stl_names]
+        self._stl_names = list(stl_names)
         self._config = config
-        try:
-            self._mtime = os.stat(self._stl_name).st_mtime
-        except OSError:
-            sys.exit(0)
+        self._launched = launched
+        self._updates = updates
+        self._single = len(self._stl_names) == 1 and not config.get('single_window')
+        self._meshes = dict(meshes or {})  # not yet shown
+        self._shms = {}  # stl name -> shared memory backing its actor
+        self._mtimes = {}
+        self._stamps = {}  # stl name -> rebuild that wrote what's shown (see mesh.stamp)
+        if self._single and not self._meshes:
+            try:
+                os.stat(self._stl_names[0])
+            except OSError:
+                sys.exit(0)
+        self._watcher = watcher(self._stl_names, config.get('watch'))
         self._colors = vtkNamedColors()
-        self._actor = None
+        self._actors = {}
+        self._loader = ThreadPoolExecutor(max_workers=1)
+        self._loading = {}  # stl name -> future of its polydata
+        self._decimator = ThreadPoolExecutor(max_workers=1)
+        self._decimating = {}  # stl name -> (polydata, future of its levels of detail)
         self._ren = vtkRenderer()
         self._renWin = vtkRenderWindow()
         self._renWin.AddRenderer(self._ren)
-        self._renWin.SetWindowName(os.path.basename(self._stl_name))
+        if self._single:
+            self._renWin.SetWindowName(os.path.basename(self._stl_names[0]))
+        else:
+            self._renWin.SetWindowName(os.path.basename(os.path.dirname(
+                os.path.abspath(self._stl_names[0])) if self._stl_names else 'cqmodel'))
         self._iren = vtkRenderWindowInteractor()
         self._iren.SetRenderWindow(self._renWin)
+        self._iren.SetDesiredUpdateRate(config.get('lod_rate', 15))
         self._ren.SetBackground(self._colors.GetColor3d('DarkOliveGreen'))
 
-    def create_actor(self):
-        reader = vtkSTLReader()
-        reader.SetFileName(self._stl_name)
+    def create_actor(self, polydata):
         mapper = vtkPolyDataMapper()
-        mapper.SetInputConnection(reader.GetOutputPort())
-        actor = vtkActor()
+        mapper.SetInputData(polydata)
+        actor = vtkLODActor()
         actor.SetMapper(mapper)
+        self.set_lods(actor, [polydata])
         actor.GetProperty().SetDiffuse(0.8)
         actor.GetProperty().SetDiffuseColor(self._colors.GetColor3d('LightSteelBlue'))
         actor.GetProperty().SetSpecular(0.3)
         actor.GetProperty().SetSpecularPower(60.0)
         return actor
 
-    def maybe_reload_model(self, *args):
+    @staticmethod
+    def set_lods(actor, levels) -> None:
+        """Give actor levels of detail to draw while the view moves.  Always
+        some, even if just the full mesh, or vtkLODActor makes a point cloud."""
+        actor.GetLODMappers().RemoveAllItems()
+        for polydata in levels:
+            mapper = vtkPolyDataMapper()
+            mapper.SetInputData(polydata)
+            actor.AddLODMapper(mapper)
+        actor.Modified()
+
+    @staticmethod
+    def decimate(polydata, triangles:int) -> list:
+        """Levels of detail for a mesh of more than triangles triangles, each
+        a quarter of the one before, down to triangles.  Runs on the
+        decimator thread, so nothing here may touch the renderer."""
+        levels = []
+        level = vtkPolyData()
+        level.ShallowCopy(polydata)
+        while level.GetNumberOfPolys() > triangles:
+            decimation = vtkQuadricDecimation()
+            decimation.SetInputData(level)
+            decimation.SetTargetReduction(0.75)
+            decimation.Update()
+            if decimation.GetOutput().GetNumberOfPolys() >= level.GetNumberOfPolys():
+                break
+            level = vtkPolyData()
+            level.ShallowCopy(decimation.GetOutput())
+            levels.append(level)
+        return levels
+
+    @staticmethod
+    def read_stl(stl_name:str):
+        """Read an .stl, or a mesh .npz (see mesh.save), into vtkPolyData.
+        Runs on the loader thread, so nothing here may touch the renderer."""
+        if stl_name.endswith('.npz'):
+            return Viewer.arrays_polydata(*mesh.load(stl_name))
+        reader = vtkSTLReader()
+        reader.SetFileName(stl_name)
+        reader.Update()
+        polydata = vtkPolyData()
+        polydata.ShallowCopy(reader.GetOutput())
+        return polydata
+
+    @staticmethod
+    def read_part(stl_name:str):
+        """(stamp, polydata) of a part's file; the stamp first, so a newer
+        file renamed in meanwhile only costs a second read"""
+        return mesh.stamp(stl_name), Viewer.read_stl(stl_name)
+
+    @staticmethod
+    def arrays_polydata(vertices, triangles):
+        """vtkPolyData drawing straight from float32 vertices and int64
+        triangles, which it keeps referenced"""
+        points = vtkPoints()
+        points.SetData(numpy_to_vtk(vertices, deep=False))
+        offsets = np.arange(0, triangles.size + 1, 3, dtype=np.int64)
+        cells = vtkCellArray()
+        cells.SetData(numpy_to_vtkIdTypeArray(offsets, deep=True),
+                      numpy_to_vtkIdTypeArray(triangles.reshape(-1), deep=False))
+        polydata = vtkPolyData()
+        polydata.SetPoints(points)
+        polydata.SetPolys(cells)
+        return polydata
+
+    @staticmethod
+    def mesh_polydata(descriptor:dict):
+        """(shm, polydata) drawing straight from a shared memory mesh"""
+        shm, vertices, triangles = mesh.attach(descriptor)
+        return shm, Viewer.arrays_polydata(vertices, triangles)
+
+    def _show(self, stl_name:str, polydata) -> None:
+        """Swap polydata into the part's actor (no empty frame, camera left
+        be), or make the actor if the part is new"""
+        print(f"Reload {os.path.basename(stl_name)}...")
+        actor = self._actors.get(stl_name)
+        if actor is None:
+            self._actors[stl_name] = actor = self.create_actor(polydata)
+            self._ren.AddActor(actor)
+        else:
+            actor.GetMapper().SetInputData(polydata)
+            self.set_lods(actor, [polydata])
+        lod_triangles = self._config.get('lod_triangles', LOD_TRIANGLES)
+        if lod_triangles and polydata.GetNumberOfPolys() > lod_triangles:
+            self._decimating[stl_name] = (polydata, self._decimator.submit(
+                self.decimate, polydata, lod_triangles))
+
+    def _finish_decimating(self) -> None:
+        """Hand actors their levels of detail as they're made, unless the
+        mesh they were made from has been replaced meanwhile"""
+        for stl_name, (polydata, future) in list(self._decimating.items()):
+            if not future.done():
+                continue
+            del self._decimating[stl_name]
+            actor = self._actors.get(stl_name)
+            if actor is not None and actor.GetMapper().GetInput() is polydata:
+                self.set_lods(actor, future.result() + [polydata])
+
+    def _drop(self, stl_name:str) -> bool:
+        self._mtimes.pop(stl_name, None)
+        self._stamps.pop(stl_name, None)
+        self._loading.pop(stl_name, None)
+        self._decimating.pop(stl_name, None)
+        if stl_name in self._shms:
+            mesh.detach(self._shms.pop(stl_name))
+        actor = self._actors.pop(stl_name, None)
+        if actor is not None:
+            self._ren.RemoveActor(actor)
+        return actor is not None
+
+    def _layout(self) -> None:
+        """Place actors in a grid on the XY plane, or leave them as modeled"""
+        names = sorted(self._actors)
+        if self._config.get('layout', 'grid') != 'grid' or len(names) < 2:
+            for name in names:
+                self._actors[name].SetPosition(0, 0, 0)
+            return
+        bounds = {name: self._actors[name].GetMapper().GetBounds() for name in names}
+        cell_x = max(b[1] - b[0] for b in bounds.values()) * 1.2
+        cell_y = max(b[3] - b[2] for b in bounds.values()) * 1.2
+        columns = math.ceil(math.sqrt(len(names)))
+        for i, name in enumerate(names):
+            b = bounds[name]
+            row, column = divmod(i, columns)
+            self._actors[name].SetPosition(column * cell_x - b[0],
+                                           -row * cell_y - b[2],
+                                           -b[4])
+
+    def _load(self, stl_name:str) -> bool:
+        """Start reloading stl_name in the background if it changed.
+
+        Returns whether the scene changed now, which is only if the file
+        went away; _finish_loads shows what's been read.
+        """
         try:
-            mtime = os.stat(self._stl_name).st_mtime
+            mtime = os.stat(stl_name).st_mtime
         except OSError:
-            sys.exit(0)
-        if mtime != self._mtime:
-            print("Reload...")
-            self._mtime = mtime
-
-            # Time will go by, flash window empty for the duration
-            self._ren.RemoveActor(self._actor)
-            self._renWin.Render()
-            actor = self.create_actor()
-            self._ren.AddActor(actor)
-            self._renWin.Render()
-            self._actor = actor
+            if self._single:
+                sys.exit(0)
+            return self._drop(stl_name)
+        if stl_name in self._mtimes and mtime == self._mtimes[stl_name]:
+            return False
+        self._mtimes[stl_name] = mtime
+        # Latest wins: an older read still going gets ignored when it lands
+        self._loading[stl_name] = self._loader.submit(self.read_part, stl_name)
+        return False
 
-    def view(self) -> None:
-        self._actor = self.create_actor()
+    def _finish_loads(self, wait:bool=False) -> bool:
+        """Show whatever the loader thread has finished reading"""
+        changed = False
+        for stl_name, future in list(self._loading.items()):
+            if not (wait or future.done()):
+                continue
+            del self._loading[stl_name]
+            try:
+                stamp, polydata = future.result()
+            except Exception as e:
+                print(f"Trouble reading {stl_name}: {e}")
+                continue
+            if stamp is not None and stamp == self._stamps.get(stl_name):
+                continue  # showing this rebuild's mesh already
+            self._stamps[stl_name] = stamp
+            self._show(stl_name, polydata)
+            changed = True
+        return changed
 
-        # Assign actor to the renderer
-        self._ren.AddActor(self._actor)
+    def _load_mesh(self, stl_name:str, descriptor) -> bool:
+        """Show a part's new shared memory mesh, or drop the part if None"""
+        if descriptor is None:
+            if self._single:
+                sys.exit(0)
+            return self._drop(stl_name)
+        try:
+            shm, polydata = self.mesh_polydata(descriptor)
+        except FileNotFoundError:  # superseded already; a newer one is coming
+            return False
+        self._loading.pop(stl_name, None)
+        self._stamps.pop(stl_name, None)
+        self._show(stl_name, polydata)
+        if stl_name in self._shms:
+            mesh.detach(self._shms[stl_name])
+        self._shms[stl_name] = shm
+        return True
+
+    def _set_parts(self, stl_names) -> bool:
+        changed = False
+        for stl_name in (set(self._actors) | set(self._loading)) - set(stl_names):
+            changed |= self._drop(stl_name)
+        self._stl_names = list(stl_names)
+        self._watcher.set_paths(self._stl_names)
+        for stl_name in self._stl_names:
+            if stl_name not in self._shms:
+                changed |= self._load(stl_name)
+        return changed
+
+    def maybe_reload_model(self, *args):
+        changed = False
+        latest = None
+        while self._updates is not None:
+            try:
+                update = self._updates.get_nowait()
+            except queue.Empty:
+                break
+            if isinstance(update, dict):
+                self._meshes.update(update)
+            else:
+                latest = update
+        if latest is not None:
+            changed |= self._set_parts(latest)
+        for stl_name, descriptor in self._meshes.items():
+            changed |= self._load_mesh(stl_name, descriptor)
+        self._meshes.clear()
+        for stl_name in self._watcher.poll():
+            if stl_name in self._stl_names and stl_name not in self._shms:
+                changed |= self._load(stl_name)
+        changed |= self._finish_loads()
+        self._finish_decimating()  # nothing to see until the view moves
+        if changed:
+            self._layout()
+            self._renWin.Render()  # all changed parts at once
+
+    def view(self) -> None:
+        for stl_name, descriptor in self._meshes.items():
+            self._load_mesh(stl_name, descriptor)
+        self._meshes.clear()
+        for stl_name in self._stl_names:
+            if stl_name not in self._shms:
+                self._load(stl_name)
+        self._finish_loads(wait=True)  # nothing to show yet anyway
+        self._layout()
+        self._ren.ResetCamera()
 
         # Enable user interface interactor
         self._iren.Initialize()
         self._renWin.Render()
+        if self._launched is not None:
+            print(f'{self._renWin.GetWindowName()}: window up in '
+                  f'{time.time() - self._launched:.2f} s')
 
         self.maybe_reload_model()
 
-        self._iren.CreateRepeatingTimer(100)
+        # Cheap: checks in with the watcher, which only stats when polling
+        self._iren.CreateRepeatingTimer(50)
         self._iren.AddObserver("TimerEvent",
                                self.maybe_reload_model)
         self._iren.Start()
 
-def view_stl(stl_file):
-    Viewer(stl_file, {}).view()
+def view_stl(stl_file, launched=None, updates=None, meshes=None, config=None):
+    Viewer(stl_file, dict(config or {}), launched, updates, meshes).view()
+
+def view_stls(stl_files, launched=None, updates=None, config=None, meshes=None):
+    """All of a model's parts in one window; updates is a queue of new lists"""
+    Viewer(stl_files, dict(config or {}, single_window=True), launched, updates,
+           meshes).view()
 
 if __name__ == '__main__':
     p = argparse.ArgumentParser()
-    p.add_argument('stl_file', type=str)
+    p.add_argument('stl_file', type=str, nargs='+')
+    p.add_argument('--layout', choices=['grid', 'assembled'], default='grid')
+    p.add_argument('--lod-triangles', type=int, default=LOD_TRIANGLES,
+                   help="Decimate parts of more triangles while the view moves (0: never)")
     a = p.parse_args()
-    view_stl(a.stl_file)
+    config = {'layout': a.layout, 'lod_triangles': a.lod_triangles}
+    if len(a.stl_file) == 1:
+        view_stl(a.stl_file[0], config=config)
+    else:
+        view_stls(a.stl_file, config=config)
@@ -0,0 +1,220 @@
+"""Notice when files change: inotify on Linux, stat() polling elsewhere.
+
+Both watchers offer poll(), which returns the set of changed paths without
+blocking, and wait(), which blocks until something changes.  The inotify
+watcher watches the containing directories, so editors that save by writing
+a new file and renaming it over the old one still get noticed.
+"""
+
+import ast
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import sys
+import sysconfig
+import time
+from os.path import abspath, dirname, basename, join, realpath, isfile
+
+ASSET_SUFFIXES = ('.dxf', '.svg', '.step', '.stp', '.brep')
+
+class PollingWatcher:
+    def __init__(self, paths=(), interval:float=0.1):
+        self.interval = interval
+        self._stats = {}
+        self._polled = 0
+        self.set_paths(paths)
+
+    @staticmethod
+    def _stat(path:str):
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        return (st.st_mtime_ns, st.st_size, st.st_ino)
+
+    def set_paths(self, paths) -> None:
+        """Watch paths, remembering what's known of any already watched"""
+        paths = {abspath(p) for p in paths}
+        self._stats = {p: self._stats[p] if p in self._stats else self._stat(p)
+                       for p in paths}
+
+    def poll(self) -> set:
+        now = time.monotonic()
+        if now - self._polled < self.interval:
+            return set()
+        self._polled = now
+        changed = set()
+        for path, old in self._stats.items():
+            new = self._stat(path)
+            if new != old:
+                self._stats[path] = new
+                changed.add(path)
+        return changed
+
+    def wait(self, timeout:float=None) -> set:
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            changed = self.poll()
+            if changed or (deadline is not None and time.monotonic() >= deadline):
+                return changed
+            time.sleep(self.interval)
+
+    def fileno(self):
+        return None
+
+    def close(self) -> None:
+        pass
+
+class InotifyWatcher:
+    IN_ATTRIB = 0x4
+    IN_CLOSE_WRITE = 0x8
+    IN_MOVED_FROM = 0x40
+    IN_MOVED_TO = 0x80
+    IN_DELETE = 0x200
+    IN_Q_OVERFLOW = 0x4000
+    IN_IGNORED = 0x8000
+    IN_ONLYDIR = 0x1000000
+    IN_NONBLOCK = 0o4000
+    IN_CLOEXEC = 0o2000000
+    _EVENT = struct.Struct('iIII')  # wd, mask, cookie, len; then name
+
+    def __init__(self, paths=()):
+        self._libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        self._fd = self._libc.inotify_init1(self.IN_NONBLOCK | self.IN_CLOEXEC)
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1")
+        self._paths = set()
+        self._wds = {}  # directory -> watch descriptor
+        self._dirs = {}  # watch descriptor -> directory
+        self.set_paths(paths)
+
+    def set_paths(self, paths) -> None:
+        self._paths = {abspath(p) for p in paths}
+        needed = {dirname(p) for p in self._paths}
+        for d in set(self._wds) - needed:
+            self._libc.inotify_rm_watch(self._fd, self._wds[d])
+            del self._dirs[self._wds.pop(d)]
+        mask = (self.IN_CLOSE_WRITE | self.IN_MOVED_TO | self.IN_MOVED_FROM
+                | self.IN_DELETE | self.IN_ATTRIB | self.IN_ONLYDIR)
+        for d in needed - set(self._wds):
+            wd = self._libc.inotify_add_watch(self._fd, os.fsencode(d), mask)
+            if wd < 0:
+                continue  # directory is gone; nothing there to change
+            self._wds[d] = wd
+            self._dirs[wd] = d
+
+    def poll(self) -> set:
+        changed = set()
+        while True:
+            try:
+                buf = os.read(self._fd, 64 * 1024)
+            except BlockingIOError:
+                return changed
+            offset = 0
+            while offset < len(buf):
+                wd, mask, cookie, length = self._EVENT.unpack_from(buf, offset)
+                offset += self._EVENT.size
+                name = buf[offset:offset + length].rstrip(b'\0')
+                offset += length
+                if mask & self.IN_Q_OVERFLOW:
+                    changed |= self._paths  # lost track, so everything
+                elif mask & self.IN_IGNORED:
+                    d = self._dirs.pop(wd, None)
+                    if d is not None:
+                        del self._wds[d]
+                elif wd in self._dirs:
+                    path = join(self._dirs[wd], os.fsdecode(name))
+                    if path in self._paths:
+                        changed.add(path)
+
+    def wait(self, timeout:float=None) -> set:
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            remaining = None if deadline is None else max(0, deadline - time.monotonic())
+            select.select([self._fd], [], [], remaining)
+            changed = self.poll()
+            if changed or (deadline is not None and time.monotonic() >= deadline):
+                return changed
+
+    def fileno(self) -> int:
+        return self._fd
+
+    def close(self) -> None:
+        if self._fd >= 0:
+            os.close(self._fd)
+            self._fd = -1
+
+    def __del__(self):
+        self.close()
+
+def watcher(paths=(), backend:str=None):
+    """A watcher for paths: backend 'inotify', 'poll', or None to pick"""
+    if backend in (None, 'inotify') and sys.platform.startswith('linux'):
+        try:
+            return InotifyWatcher(paths)
+        except (OSError, AttributeError):
+            if backend == 'inotify':
+                raise
+    return PollingWatcher(paths)
+
+def _installed(path:str) -> bool:
+    """Is path part of Python or an installed package (so not being edited)?"""
+    path = realpath(path)
+    for key in ('stdlib', 'platstdlib', 'purelib', 'platlib'):
+        root = sysconfig.get_paths().get(key)
+        if root and path.startswith(realpath(root) + os.sep):
+            return True
+    return False
+
+def _source_tree(module):
+    try:
+        with open(module.__file__, 'r') as f:
+            return ast.parse(f.read())
+    except (OSError, SyntaxError, TypeError):
+        return None
+
+def local_imports(module) -> list:
+    """Modules the model imports that aren't installed, like cqmodel.util"""
+    tree = _source_tree(module)
+    if tree is None:
+        return []
+    names = []
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            names.extend(alias.name for alias in node.names)
+        elif isinstance(node, ast.ImportFrom) and node.module and not node.level:
+            names.append(node.module)
+            names.extend(f'{node.module}.{alias.name}' for alias in node.names)
+    found = []
+    for name in names:
+        m = sys.modules.get(name)
+        f = getattr(m, '__file__', None)
+        if f and not _installed(f) and m is not module and m not in found:
+            found.append(m)
+    return found
+
+def asset_paths(module) -> list:
+    """Files like .dxf that the model source names, as found near the model"""
+    tree = _source_tree(module)
+    if tree is None:
+        return []
+    found = []
+    for node in ast.walk(tree):
+        if (isinstance(node, ast.Constant) and isinstance(node.value, str)
+                and node.value.lower().endswith(ASSET_SUFFIXES)):
+            model_dir = dirname(abspath(module.__file__))
+            for candidate in (node.value, join(model_dir, node.value),
+                              join(model_dir, basename(node.value))):
+                if isfile(candidate):
+                    if abspath(candidate) not in found:
+                        found.append(abspath(candidate))
+                    break
+    return found
+
+def model_paths(module) -> list:
+    """Every file whose change should rebuild the model"""
+    return ([abspath(module.__file__)]
+            + [abspath(m.__file__) for m in local_imports(module)]
+            + asset_paths(module))
@@ -0,0 +1,46 @@
+import importlib
+import sys
+from cqmodel import cache
+
+MODEL = '''
+import cadquery as cq
+
+class Peg:
+    def __init__(self, height):
+        self.height = height
+
+    def solid(self):
+        return cq.Workplane('XY').circle(self.height).extrude(10)
+
+class Part:
+    def __init__(self):
+        self.peg = Peg(3)
+
+    def body(self):
+        return self.peg.solid()
+'''
+
+def _key(path, source):
+    path.write_text(source)
+    sys.modules.pop('peg_model', None)
+    module = importlib.import_module('peg_model')
+    return cache.part_key(module, 'Part.body', module.Part().body)
+
+def test_key_follows_held_model_objects(tmp_path, monkeypatch):
+    monkeypatch.syspath_prepend(str(tmp_path))
+    path = tmp_path / 'peg_model.py'
+    key = _key(path, MODEL)
+    assert _key(path, MODEL) == key
+    assert _key(path, MODEL.replace('extrude(10)', 'extrude(30)')) != key
+    assert _key(path, MODEL.replace('Peg(3)', 'Peg(4)')) != key
+
+def test_key_covers_the_model_for_what_it_cannot_see_into(tmp_path, monkeypatch):
+    monkeypatch.syspath_prepend(str(tmp_path))
+    path = tmp_path / 'peg_model.py'
+    model = MODEL.replace('self.peg = Peg(3)', 'self.peg = width()') + '''
+def width():
+    return cq.Workplane('XY').rect(3, 3)
+'''
+    model = model.replace('self.peg.solid()', 'self.peg.extrude(10)')
+    key = _key(path, model)
+    assert _key(path, model.replace('rect(3, 3)', 'rect(4, 4)')) != key